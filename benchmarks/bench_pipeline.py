@@ -0,0 +1,167 @@
+"""
+Replays synthetic loads through the whole Midi decode and dispatch path, without a midi device:
+- knob_sweep: 8 knobs swept up and down, with coalescing functions
+- pad_roll: note on and note off rolls over 16 pads
+- mpe_flood: pitch wheel, channel aftertouch and CC 74 on 15 MPE member channels
+
+For every load it prints the events per second, the dispatch and handler latency percentiles,
+the amount of threads that were started and the peak memory that was allocated.
+
+Run from the repository root: python benchmarks/bench_pipeline.py [--events N] [--speed S] [--record FILE]
+Without --speed everything is replayed as fast as possible. With --record, the load is written to
+FILE.<load>.midirec, which can be replayed with recording.ReplayBackend.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_macro import backends  # noqa: E402
+from midi_macro.backends import pack  # noqa: E402
+from midi_macro.dispatcher import Backpressure, PoolDispatcher  # noqa: E402
+from midi_macro.midi import Midi  # noqa: E402
+from midi_macro.recording import ReplayBackend, write_recording  # noqa: E402
+
+
+def knob_sweep(count: int) -> (array, array):
+    messages = array('I')
+    for i in range(count):
+        sweep, position = divmod(i // 8, 128)
+        value = position if sweep % 2 == 0 else 127 - position
+        messages.append(pack(0xB0, 1 + i % 8, value))
+    # A message every ms
+    return messages, array('I', range(count))
+
+
+def pad_roll(count: int) -> (array, array):
+    messages = array('I')
+    for i in range(count):
+        note = 36 + (i // 2) % 16
+        messages.append(pack(0x90, note, 100) if i % 2 == 0 else pack(0x80, note, 0))
+    # Two messages every ms
+    return messages, array('I', (i // 2 for i in range(count)))
+
+
+def mpe_flood(count: int) -> (array, array):
+    messages = array('I')
+    for i in range(count):
+        channel = 1 + (i // 3) % 15
+        kind = i % 3
+        value = i % 128
+        if kind == 0:
+            messages.append(pack(0xE0 | channel, value, 64))
+        elif kind == 1:
+            messages.append(pack(0xD0 | channel, value))
+        else:
+            messages.append(pack(0xB0 | channel, 74, value))
+    # Ten messages every ms
+    return messages, array('I', (i // 10 for i in range(count)))
+
+
+def add_handlers(midi: Midi, load: str) -> [list]:
+    """ Adds functions that count their calls, and returns the counters """
+    counters = []
+
+    def handler() -> Callable[[tuple], None]:
+        # Calls to the same function run one at a time, so each function can have its own counter without locking
+        counter = [0]
+        counters.append(counter)
+
+        def count(values: tuple) -> None:
+            counter[0] += 1
+        return count
+
+    if load == 'knob_sweep':
+        for knob in range(1, 9):
+            midi.add_event(handler(), 1, Midi.Type.CC, knob, coalesce=True)
+    elif load == 'pad_roll':
+        midi.add_event(handler(), 1, Midi.Type.NOTE_ON, range(36, 52))
+        midi.add_event(handler(), 1, Midi.Type.NOTE_OFF, range(36, 52))
+    else:
+        members = range(2, 17)
+        midi.add_event(handler(), members, Midi.Type.PITCH_WHEEL, coalesce=True)
+        midi.add_event(handler(), members, Midi.Type.CHANNEL_AFTERTOUCH, coalesce=True)
+        midi.add_event(handler(), members, Midi.Type.CC, 74, coalesce=True)
+    return counters
+
+
+def run(load: str, messages: array, timestamps: array, speed: float) -> dict:
+    """ Replays a load, and returns the results """
+    backend = ReplayBackend(messages=messages, timestamps=timestamps, speed=speed, autoplay=False)
+    backends.register_backend('bench', backend)
+
+    # Count the threads that are started
+    started = [0]
+    thread_start = threading.Thread.start
+
+    def counting_start(thread: threading.Thread) -> None:
+        started[0] += 1
+        thread_start(thread)
+
+    threading.Thread.start = counting_start
+    try:
+        midi = Midi(0, 1, dispatcher=PoolDispatcher(backpressure=Backpressure.BLOCK), backend='bench')
+        counters = add_handlers(midi, load)
+
+        start = time.perf_counter()
+        backend.input.play()
+        while True:
+            stats = midi.stats()
+            matched = stats['received'] - stats['unmatched'] - stats['ignored']
+            done = sum(counter[0] for counter in counters)
+            if stats['received'] == len(messages) and done + stats['coalesced'] + stats['dropped'] >= matched:
+                break
+            time.sleep(0.001)
+        duration = time.perf_counter() - start
+        midi.close()
+    finally:
+        threading.Thread.start = thread_start
+
+    handler_stats = list(stats['handlers'].values())
+    return {'events/s': len(messages) / duration,
+            'dispatch p50': stats['dispatch']['p50'],
+            'dispatch p99': stats['dispatch']['p99'],
+            'latency p50': max(h['latency']['p50'] for h in handler_stats),
+            'latency p99': max(h['latency']['p99'] for h in handler_stats),
+            'coalesced': stats['coalesced'],
+            'threads': started[0]}
+
+
+def peak_memory(load: str, messages: array, timestamps: array) -> int:
+    """ Returns the peak amount of bytes allocated while replaying a load as fast as possible """
+    tracemalloc.start()
+    run(load, messages, timestamps, None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Midi input and dispatch path")
+    parser.add_argument('--events', type=int, default=50000, help="messages per load")
+    parser.add_argument('--speed', type=float, default=None, help="replay speed, 1 for real time")
+    parser.add_argument('--record', help="also write the loads to recording files with this prefix")
+    args = parser.parse_args()
+
+    print("{:<11} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9} {:>7} {:>9}".format(
+        'load', 'events/s', 'disp p50', 'disp p99', 'lat p50', 'lat p99', 'coalesced', 'threads', 'peak mem'))
+    for load in (knob_sweep, pad_roll, mpe_flood):
+        messages, timestamps = load(args.events)
+        if args.record:
+            write_recording(args.record + '.' + load.__name__ + '.midirec', messages, timestamps)
+        result = run(load.__name__, messages, timestamps, args.speed)
+        memory = peak_memory(load.__name__, messages, timestamps)
+        print("{:<11} {:>10.0f} {:>8.3f}ms {:>8.3f}ms {:>8.3f}ms {:>8.3f}ms {:>9} {:>7} {:>7.1f}MB".format(
+            load.__name__, result['events/s'], result['dispatch p50'] * 1000, result['dispatch p99'] * 1000,
+            result['latency p50'] * 1000, result['latency p99'] * 1000, result['coalesced'], result['threads'],
+            memory / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Measures how many messages per second the midi input loop handles, without a midi device.
+A fake pygame input is filled with a burst of CC messages, which are then read by
+- before: the old loop, which read 10 messages per iteration and polled and sent Active Sensing every iteration
+- after: Midi.run, which reads everything that is available in adaptive batches
+- ring: Midi.run with recycled MidiEvent objects (event_ring)
+
+Run from the repository root: python benchmarks/bench_read.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_macro import backends  # noqa: E402
+from midi_macro.midi import Midi  # noqa: E402
+
+MESSAGES = 200000
+
+
+class FakeInput:
+    """ Stands in for pygame.midi.Input """
+
+    def __init__(self, device_id: int) -> None:
+        self.events = []
+        self.position = 0
+
+    def poll(self) -> bool:
+        return self.position < len(self.events)
+
+    def read(self, max_events: int) -> list:
+        events = self.events[self.position:self.position + max_events]
+        self.position += len(events)
+        return events
+
+    def close(self) -> None:
+        pass
+
+
+class FakeOutput:
+    device_id = 1
+
+    def write_short(self, status: int, data1: int = 0, data2: int = 0) -> None:
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class FakeMidi:
+    """ Stands in for the pygame.midi module """
+    Input = FakeInput
+
+
+class BenchBackend(backends.Backend):
+    def __init__(self) -> None:
+        self.input = None
+
+    def get_devices(self) -> [tuple]:
+        return [(b'bench', b'Bench', 1, 0, 0), (b'bench', b'Bench', 0, 1, 0)]
+
+    def open_input(self, device_id: int) -> backends.PygameInput:
+        self.input = backends.PygameInput(FakeMidi, device_id)
+        return self.input
+
+    def open_output(self, device_id: int) -> FakeOutput:
+        return FakeOutput()
+
+
+class ListQueue(list):
+    """ Collects events like a Queue, without locking, like the list in before() """
+    put = list.append
+
+
+def make_events() -> list:
+    return [[[0xB0, i % 8, i % 128, 0], i] for i in range(MESSAGES)]
+
+
+def before(events: list) -> float:
+    """ The input loop as it was before batched reading """
+    midi_in = FakeInput(0)
+    midi_in.events = events
+    midi_out = FakeOutput()
+    queue = []
+    start = time.perf_counter()
+    while midi_in.poll():
+        midi_out.write_short(0b11111110)
+        if midi_in.poll():
+            for event in midi_in.read(10):
+                event = event[0]
+                status = event[0]
+                if status not in range(128, 239):
+                    continue
+                channel = (status - 127) % 16
+                m_type = Midi.Type((status - 128) // 16)
+                queue.append((channel, m_type, event[1], event[2]))
+    return time.perf_counter() - start
+
+
+def after(events: list, event_ring: int = None) -> float:
+    """ Midi.run with batched reading """
+    backend = BenchBackend()
+    backends.register_backend('bench', backend)
+    queue = ListQueue()
+    midi = Midi(0, 1, queue=queue, backend='bench', event_ring=event_ring)
+    start = time.perf_counter()
+    backend.input._input.events = events
+    while len(queue) < len(events):
+        time.sleep(0.0005)
+    duration = time.perf_counter() - start
+    midi.close()
+    return duration
+
+
+def ring(events: list) -> float:
+    """ Midi.run with recycled event objects """
+    return after(events, 1024)
+
+
+if __name__ == '__main__':
+    events = make_events()
+    for name, bench in (('before', before), ('after', after), ('ring', ring)):
+        duration = bench(events)
+        print("{:<7} {:>10.0f} messages/s".format(name, len(events) / duration))
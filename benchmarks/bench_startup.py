@@ -0,0 +1,111 @@
+"""
+Measures how long it takes to start, without a midi device:
+- import: importing midi_macro in a new process, before (when PySimpleGUI and asyncio were always imported)
+  and after (when they are only imported when needed)
+- startup: what MidiMacro(gui=True) does: listing the devices, choosing one with get_id_pair and creating a Midi
+  object, with a fake backend that takes SCAN seconds to initialise like PortMidi does.
+  Before, every get_devices() call listed the devices again.
+  The device list is only cached while a reliable device monitor (udev or /proc) runs, which a container or CI
+  machine often does not have, so a monitor that never sees a change is used instead of the real one
+
+Run from the repository root: python benchmarks/bench_startup.py
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from midi_macro import backends, midi, monitor  # noqa: E402
+from midi_macro.recording import NullOutput, ReplayInput  # noqa: E402
+
+RUNS = 5
+# Seconds that PortMidi takes to initialise with a few devices
+SCAN = 0.03
+
+
+def import_time(before: bool) -> float:
+    """ Returns the fastest time of RUNS imports in a new process """
+    eager = "import asyncio\ntry:\n    import PySimpleGUI\nexcept ImportError:\n    pass\n" if before else ""
+    code = "import time\nstart = time.perf_counter()\n" + eager + \
+           "import midi_macro\nprint(time.perf_counter() - start)"
+    times = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append(float(output.stdout))
+    return min(times)
+
+
+class ScanBackend(backends.Backend):
+    """ A backend that takes SCAN seconds to initialise """
+
+    def __init__(self) -> None:
+        self.scans = 0
+
+    def init(self) -> None:
+        self.scans += 1
+        time.sleep(SCAN)
+
+    def get_devices(self) -> [tuple]:
+        return [(b'bench', b'Bench', 1, 0, 0), (b'bench', b'Bench', 0, 1, 0)]
+
+    def open_input(self, device_id: int) -> ReplayInput:
+        return ReplayInput([], [], device_id=device_id)
+
+    def open_output(self, device_id: int) -> NullOutput:
+        return NullOutput(device_id)
+
+
+class StillMonitor(monitor.DeviceMonitor):
+    """ A reliable device monitor that never notices a change, like a machine on which no device is plugged in """
+
+    # noinspection PyMissingConstructor
+    def __init__(self) -> None:
+        self.generation = 0
+        self._changed = threading.Condition()
+        self.reliable = True
+
+
+def monitor_mode() -> str:
+    """ Returns how the real device monitor notices changes on this machine """
+    if not monitor.get_monitor().reliable:
+        return "unreliable"
+    try:
+        import pyudev  # noqa: F401
+        return "udev"
+    except ImportError:
+        return "/proc"
+
+
+class NoCache(dict):
+    """ Replaces the device cache to measure the old behaviour """
+
+    def __setitem__(self, key, value) -> None:
+        pass
+
+
+def startup(before: bool) -> (float, int):
+    """ Returns how long it takes to list, choose and open a device, and how many times the devices were scanned """
+    backend = ScanBackend()
+    backends.register_backend('bench', backend)
+    midi._devices = NoCache() if before else dict()
+    start = time.perf_counter()
+    midi.get_devices(backend='bench')
+    input_id, output_id = midi.get_id_pair(0, 'bench')
+    device = midi.Midi(input_id, output_id, backend='bench')
+    duration = time.perf_counter() - start
+    device.close()
+    return duration, backend.scans
+
+
+if __name__ == '__main__':
+    print("monitor: stubbed reliable (real monitor: {})".format(monitor_mode()))
+    monitor._monitor = StillMonitor()
+    for name, before in (('before', True), ('after', False)):
+        print("{:<7} import {:>7.1f}ms".format(name, import_time(before) * 1000))
+    for name, before in (('before', True), ('after', False)):
+        duration, scans = startup(before)
+        print("{:<7} startup {:>6.1f}ms, {} device scans".format(name, duration * 1000, scans))
@@ -0,0 +1,67 @@
+"""
+Checks that coalescing works for every message type, without a midi device:
+100 messages of each type are replayed at once to a slow coalescing function, which should only run a few times.
+Program change, channel aftertouch and pitch wheel have no control number, so all their messages on a channel
+are one control, even though value1 changes.
+
+Run from the repository root: python benchmarks/check_coalesce.py
+"""
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_macro import backends  # noqa: E402
+from midi_macro.backends import pack  # noqa: E402
+from midi_macro.dispatcher import PoolDispatcher  # noqa: E402
+from midi_macro.midi import Midi  # noqa: E402
+from midi_macro.recording import ReplayBackend  # noqa: E402
+
+MESSAGES = 100
+# Seconds that the function takes, much longer than reading all messages
+SLOW = 0.05
+# The first call runs right away and the newest values wait, so a few more calls are fine
+MAX_CALLS = 3
+
+TYPES = {Midi.Type.CC: lambda i: pack(0xB0, 7, i),
+         Midi.Type.PROGRAM_CHANGE: lambda i: pack(0xC0, i),
+         Midi.Type.CHANNEL_AFTERTOUCH: lambda i: pack(0xD0, i),
+         Midi.Type.PITCH_WHEEL: lambda i: pack(0xE0, i, 64)}
+
+
+def calls(m_type: Midi.Type) -> (int, tuple):
+    """ Replays the messages of a type, and returns how often the function ran and the last values it got """
+    messages = array('I', (TYPES[m_type](i) for i in range(MESSAGES)))
+    backend = ReplayBackend(messages=messages, timestamps=array('I', [0] * MESSAGES), speed=None, autoplay=False)
+    backends.register_backend('check', backend)
+    midi = Midi(0, 1, dispatcher=PoolDispatcher(), backend='check')
+    called = []
+
+    def slow(values: tuple) -> None:
+        called.append(values)
+        time.sleep(SLOW)
+    midi.add_event(slow, 1, m_type, coalesce=True)
+    backend.input.play()
+    while midi.stats()['received'] < MESSAGES or midi.dispatcher.pending():
+        time.sleep(0.01)
+    time.sleep(SLOW * 2)
+    midi.close()
+    return len(called), called[-1]
+
+
+def main() -> None:
+    failed = False
+    for m_type, message in TYPES.items():
+        count, last = calls(m_type)
+        packed = message(MESSAGES - 1)
+        expected = (packed >> 8 & 0x7F, packed >> 16 & 0x7F)
+        ok = count <= MAX_CALLS and last == expected
+        failed |= not ok
+        print("{:<20} {:>3} calls, last {} {}".format(m_type.name, count, last, "ok" if ok else "FAILED"))
+    assert not failed, "Some types were not coalesced"
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,16 @@
-from queue import Queue
 from threading import Thread
 
 import PySimpleGUI as sg
 
 from midi_macro import MidiMacro, midi
+from midi_macro.bus import Subscription
 from example import functions
 
 enableGui = False
 
 
 class Gui:
-    def __init__(self, queue: Queue) -> chr:
+    def __init__(self, subscription: Subscription) -> chr:
         super().__init__()
 
         def pad(n: int):
@@ -30,25 +30,24 @@ class Gui:
 
         self.window = sg.Window('Midi Macro', layout)
         self.window.finalize()
-        self.midi_thread = midi_thread = self.MidiThread(self.window, queue)
+        self.midi_thread = midi_thread = self.MidiThread(self.window, subscription)
 
     class MidiThread(Thread):
-        def __init__(self, window, queue):
+        def __init__(self, window, subscription):
             super().__init__()
             self.window = window
-            self.queue = queue
+            self.subscription = subscription
 
         def run(self):
             try:
-                while True:
-                    me = self.queue.get()
-                    if me[0] == 1:
-                        if me[1] == midi.Midi.Type.CC:
-                            self.window['knob' + str(me[2])].update(me[3])
-                        elif me[1] == midi.Midi.Type.NOTE_ON:
-                            self.window['pad' + str(me[2] - 35)].update(button_color=('black', 'white'))
-                        elif me[1] == midi.Midi.Type.NOTE_OFF:
-                            self.window['pad' + str(me[2] - 35)].update(button_color=('white', 'black'))
+                for me in self.subscription:
+                    _, m_type, value1, value2, _ = me
+                    if m_type == midi.Midi.Type.CC:
+                        self.window['knob' + str(value1)].update(value2)
+                    elif m_type == midi.Midi.Type.NOTE_ON:
+                        self.window['pad' + str(value1 - 35)].update(button_color=('black', 'white'))
+                    elif m_type == midi.Midi.Type.NOTE_OFF:
+                        self.window['pad' + str(value1 - 35)].update(button_color=('white', 'black'))
             except KeyboardInterrupt:
                 pass
 
@@ -68,12 +67,13 @@ class Gui:
 
 
 if __name__ == "__main__":
-    queue = Queue()
-    m = MidiMacro(functions.Functions, queue, enableGui)
+    m = MidiMacro(functions.Functions, gui=enableGui)
     m.start()
 
     if enableGui:
-        Gui(queue).run()
+        # Only keeps the newest events if the window falls behind
+        types = [midi.Midi.Type.CC, midi.Midi.Type.NOTE_ON, midi.Midi.Type.NOTE_OFF]
+        Gui(m.midi_device.subscribe(types=types, channels=1)).run()
     else:
         input('Enter to exit')
     m.close()
@@ -1,46 +1,129 @@
+import threading
 from typing import Optional
 
 import pympris
 import dbus
 from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+MPRIS_PREFIX = 'org.mpris.MediaPlayer2.'
+MPRIS_PATH = '/org/mpris/MediaPlayer2'
+
+
+class Player:
+    """ A media player with its cached properties """
+    __slots__ = ('media_player', 'identity', 'status', 'owner')
+
+    def __init__(self, media_player: pympris.MediaPlayer, identity: str, status: str, owner: str) -> None:
+        self.media_player = media_player
+        self.identity = identity
+        self.status = status
+        self.owner = owner
 
 
 class MprisControl:
+    """
+    Controls media players using MPRIS.
+    The available players and their status are kept up to date using D-Bus signals,
+    so choosing a player does not need any D-Bus calls.
+    """
+
     def __init__(self):
         self.__dbus_loop = DBusGMainLoop()
         self.__bus = dbus.SessionBus(mainloop=self.__dbus_loop)
 
         self.__last_controlled_player_name = 'Spotify'
 
+        # Bus name -> Player, and unique bus name (the sender of signals) -> bus name
+        self.__lock = threading.Lock()
+        self.__players = dict()
+        self.__owners = dict()
+
+        # Listen to signals before filling the registry, so that no changes are missed
+        self.__bus.add_signal_receiver(self.__on_name_owner_changed, 'NameOwnerChanged', 'org.freedesktop.DBus')
+        self.__bus.add_signal_receiver(self.__on_properties_changed, 'PropertiesChanged',
+                                       'org.freedesktop.DBus.Properties', path=MPRIS_PATH, sender_keyword='sender')
+        for name in pympris.available_players():
+            self.__add_player(name)
+
+        # Signals are only delivered while a GLib main loop is running
+        self.__loop = GLib.MainLoop()
+        loop_thread = threading.Thread(target=self.__loop.run, name="MPRIS signals")
+        loop_thread.daemon = True
+        loop_thread.start()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         return
 
+    def close(self) -> None:
+        self.__loop.quit()
+
+    def __add_player(self, name: str) -> None:
+        try:
+            media_player = pympris.MediaPlayer(name, self.__bus)
+            player = Player(media_player, str(media_player.root.Identity), str(media_player.player.PlaybackStatus),
+                            str(self.__bus.get_name_owner(name)))
+        except dbus.DBusException:
+            # The player has already quit
+            return
+        with self.__lock:
+            self.__players[name] = player
+            self.__owners[player.owner] = name
+
+    def __remove_player(self, name: str) -> None:
+        with self.__lock:
+            player = self.__players.pop(name, None)
+            if player is not None:
+                self.__owners.pop(player.owner, None)
+
+    def __on_name_owner_changed(self, name: str, old_owner: str, new_owner: str) -> None:
+        if not name.startswith(MPRIS_PREFIX):
+            return
+        if old_owner:
+            self.__remove_player(name)
+        if new_owner:
+            self.__add_player(name)
+
+    def __on_properties_changed(self, interface: str, changed: dict, invalidated: list, sender: str = None) -> None:
+        with self.__lock:
+            name = self.__owners.get(sender)
+            if name is None:
+                return
+            player = self.__players[name]
+            if 'PlaybackStatus' in changed:
+                player.status = str(changed['PlaybackStatus'])
+            if 'Identity' in changed:
+                player.identity = str(changed['Identity'])
+
+    def __get_players(self) -> [Player]:
+        with self.__lock:
+            return list(self.__players.values())
+
     def get_players(self) -> [pympris.MediaPlayer]:
-        players = list(pympris.available_players())
-        return [pympris.MediaPlayer(player, self.__bus) for player in players]
+        return [player.media_player for player in self.__get_players()]
 
     def get_playing_players(self) -> [pympris.MediaPlayer]:
-        players = self.get_players()
-        return [player for player in players if player.player.PlaybackStatus == 'Playing']
+        return [player.media_player for player in self.__get_players() if player.status == 'Playing']
 
-    def __get_priority_player(self, players: [pympris.MediaPlayer]) -> pympris.MediaPlayer:
+    def __get_priority_player(self, players: [Player]) -> Player:
         if len(players) > 0:
             for player in players:
-                if player.root.Identity == self.__last_controlled_player_name:
+                if player.identity == self.__last_controlled_player_name:
                     return player
             return players[0]
 
     def __get_player_to_control(self) -> Optional[pympris.MediaPlayer]:
-        player = self.__get_priority_player(self.get_playing_players())
+        players = self.__get_players()
+        player = self.__get_priority_player([player for player in players if player.status == 'Playing'])
         if player is None:
-            player = self.__get_priority_player(self.get_players())
+            player = self.__get_priority_player(players)
             if player is None:
                 return
-        self.__last_controlled_player_name = str(player.root.Identity)
-        return player
+        self.__last_controlled_player_name = player.identity
+        return player.media_player
 
     def play_pause_auto(self) -> None:
         player = self.__get_player_to_control()
@@ -1,69 +1,230 @@
+import threading
+import time
+
 import pulsectl
 
 
 class PulseControl:
+    """
+    Long-lived PulseAudio connection.
+    The list of streams (sink inputs) is kept up to date using PulseAudio events on a second connection,
+    so finding a stream does not need a request, and changing its volume only needs one.
+    Volume changes are written by a separate thread, at most MAX_RATE times per second per stream.
+    When PulseAudio (or PipeWire) restarts, for example after a suspend, both connections are opened again.
+    """
+    MAX_RATE = 60
+    # Seconds between attempts to connect again while PulseAudio is not running
+    RECONNECT_DELAY = 1
+
     def __init__(self, name: str = "Python control"):
+        self._name = name
         self.pulse = pulsectl.Pulse(name)
+        # pulsectl connections can not be used from multiple threads at once
+        self._lock = threading.RLock()
+
+        # Stream index -> stream, and indexes of streams per name and per property
+        self._streams = dict()
+        self._by_name = dict()
+        self._by_prop = dict()
+        self._connect_events()
+
+        self._running = True
+        self._listener = threading.Thread(target=self._listen, name="PulseAudio events")
+        self._listener.daemon = True
+        self._listener.start()
+
+        # Stream index -> (stream, level) of volumes that still need to be written
+        self._writes = dict()
+        # Stream index -> time of the last volume write
+        self._last_writes = dict()
+        self._writes_changed = threading.Condition()
+        self._writer = threading.Thread(target=self._write, name="PulseAudio writes")
+        self._writer.daemon = True
+        self._writer.start()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._running = False
+        self._events.event_listen_stop()
+        self._listener.join()
+        with self._writes_changed:
+            self._writes_changed.notify()
+        self._writer.join()
+        self._events.close()
         self.pulse.close()
 
-    def get_stream_list(self) -> [pulsectl.PulseSinkInfo]:
-        return self.pulse.sink_input_list()
-
-    def get_stream(self, name: str) -> pulsectl.PulseSinkInfo:
-        for stream in self.get_stream_list():
-            if stream.name == name:
-                return stream
-
-    def get_stream_by_prop(self, *props: (str, str)) -> pulsectl.PulseSinkInfo:
-        candidate_sets = []
-
-        # Loop through properties and generate sets of candidates that have those properties
-        for i, prop in enumerate(props):
-            candidate_sets.append([])
-            for stream in self.get_stream_list():
-                if stream.proplist[prop[0]] == prop[1]:
-                    candidate_sets[i].append(stream)
-
-        result = []
-        # Get intersection of candidate sets
-        for i, candidates in enumerate(candidate_sets):
-            if i == 0:
-                result = candidates
-                continue
-            for r in result:
-                if r.index not in [c.index for c in candidates]:
-                    result.remove(r)
-        return result[0]
-
-    def set_stream_volume(self, stream: pulsectl.PulseSinkInfo, level: float) -> None:
-        if stream is not None:
-            self.pulse.volume_set_all_chans(stream, level)
+    def _check_connection(self) -> None:
+        """ Open the request connection again if PulseAudio restarted, call with self._lock held """
+        if not self.pulse.connected:
+            self.pulse.close()
+            self.pulse = pulsectl.Pulse(self._name)
+
+    def _connect_events(self) -> None:
+        """ Open the event connection and list the streams """
+        # Subscribe before listing the streams, so that no changes are missed
+        self._events = pulsectl.Pulse(self._name + " events")
+        self._events.event_mask_set('sink_input')
+        self._events.event_callback_set(self._on_event)
+        self._changes = []
+        with self._lock:
+            self._check_connection()
+            streams = self.pulse.sink_input_list()
+            self._streams.clear()
+            self._by_name.clear()
+            self._by_prop.clear()
+            for stream in streams:
+                self._add_stream(stream)
+
+    def _reconnect_events(self) -> None:
+        """ Connect again after PulseAudio restarted, the streams have new indexes then """
+        while self._running:
+            self._events.close()
+            try:
+                self._connect_events()
+                return
+            except pulsectl.PulseError:
+                # It is not running again yet
+                time.sleep(self.RECONNECT_DELAY)
+
+    def _add_stream(self, stream: pulsectl.PulseSinkInputInfo) -> None:
+        self._remove_stream(stream.index)
+        self._streams[stream.index] = stream
+        self._by_name.setdefault(stream.name, set()).add(stream.index)
+        for prop in stream.proplist.items():
+            self._by_prop.setdefault(prop, set()).add(stream.index)
+
+    def _remove_stream(self, index: int) -> None:
+        stream = self._streams.pop(index, None)
+        if stream is None:
+            return
+        self._by_name[stream.name].discard(index)
+        for prop in stream.proplist.items():
+            self._by_prop[prop].discard(index)
+
+    def _on_event(self, event: pulsectl.PulseEventInfo) -> None:
+        # Requests can not be made from the event callback, so stop listening and handle them in _listen
+        self._changes.append((event.t, event.index))
+        raise pulsectl.PulseLoopStop
+
+    def _listen(self) -> None:
+        while self._running:
+            try:
+                # Use a timeout so that close() can not be missed
+                self._events.event_listen(timeout=1)
+                changes, self._changes = self._changes, []
+                for change, index in changes:
+                    stream = None
+                    if change != 'remove':
+                        try:
+                            stream = self._events.sink_input_info(index)
+                        except pulsectl.PulseIndexError:
+                            # Already removed again
+                            pass
+                    with self._lock:
+                        if stream is None:
+                            self._remove_stream(index)
+                        else:
+                            self._add_stream(stream)
+            except (pulsectl.PulseDisconnected, pulsectl.PulseOperationFailed):
+                # Requests fail with PulseOperationFailed when the connection is gone
+                if self._running and not self._events.connected:
+                    self._reconnect_events()
+
+    def get_stream_list(self) -> [pulsectl.PulseSinkInputInfo]:
+        with self._lock:
+            return list(self._streams.values())
+
+    def get_stream(self, name: str) -> pulsectl.PulseSinkInputInfo:
+        with self._lock:
+            indexes = self._by_name.get(name)
+            if indexes:
+                return self._streams[min(indexes)]
+
+    def get_stream_by_prop(self, *props: (str, str)) -> pulsectl.PulseSinkInputInfo:
+        with self._lock:
+            # Get intersection of the streams that have each property
+            result = set(self._streams)
+            for prop in props:
+                result &= self._by_prop.get(prop, set())
+            if not result:
+                raise IndexError("No stream has properties " + str(props))
+            return self._streams[min(result)]
+
+    def set_stream_volume(self, stream: pulsectl.PulseSinkInputInfo, level: float, blocking: bool = False) -> None:
+        """
+        Set the volume of a stream
+        :param stream: the stream, nothing happens if it is None
+        :param level: volume, 1.0 is 100%
+        :param blocking: write the volume now instead of in the background. In the background, a write that
+            comes in while an older one for the same stream is waiting replaces it, so only the newest level is sent
+        """
+        if stream is None:
+            return
+        if blocking:
+            with self._lock:
+                self._check_connection()
+                self.pulse.volume_set_all_chans(stream, level)
+            return
+        with self._writes_changed:
+            self._writes[stream.index] = (stream, level)
+            self._writes_changed.notify()
+
+    def _write(self) -> None:
+        interval = 1 / self.MAX_RATE
+        while self._running:
+            with self._writes_changed:
+                if not self._writes:
+                    self._writes_changed.wait()
+                    continue
+                # Write the streams that have not been written to recently, wait for the others
+                now = time.monotonic()
+                due = [index for index in self._writes if now - self._last_writes.get(index, 0) >= interval]
+                if not due:
+                    self._writes_changed.wait(min(self._last_writes[index] + interval - now
+                                                  for index in self._writes))
+                    continue
+                writes = [self._writes.pop(index) for index in due]
+
+            for stream, level in writes:
+                try:
+                    with self._lock:
+                        self._check_connection()
+                        self.pulse.volume_set_all_chans(stream, level)
+                except (pulsectl.PulseError, pulsectl.PulseDisconnected):
+                    # The stream has been removed, or PulseAudio restarted (the stream then has a new index)
+                    # or is not running yet. The next write connects again
+                    pass
+                self._last_writes[stream.index] = time.monotonic()
 
     def mute_default_output(self, mute: bool = None) -> None:
-        default_output = self.pulse.server_info().default_sink_name
-        output_index = [p.index for p in self.pulse.sink_list() if p.name == default_output][0]
+        with self._lock:
+            self._check_connection()
+            default_output = self.pulse.server_info().default_sink_name
+            output_index = [p.index for p in self.pulse.sink_list() if p.name == default_output][0]
 
-        if mute is None:
-            mute = not self.pulse.sink_info(output_index).mute
+            if mute is None:
+                mute = not self.pulse.sink_info(output_index).mute
 
-        if mute:
-            self.pulse.sink_mute(output_index, True)
-        else:
-            self.pulse.sink_mute(output_index, False)
+            if mute:
+                self.pulse.sink_mute(output_index, True)
+            else:
+                self.pulse.sink_mute(output_index, False)
 
     def mute_default_input(self, mute: bool = None) -> None:
-        default_input = self.pulse.server_info().default_source_name
-        input_index = [p.index for p in self.pulse.source_list() if p.name == default_input][0]
-
-        if mute is None:
-            mute = not self.pulse.source_info(input_index).mute
-
-        if mute:
-            self.pulse.source_mute(input_index, True)
-        else:
-            self.pulse.source_mute(input_index, False)
+        with self._lock:
+            self._check_connection()
+            default_input = self.pulse.server_info().default_source_name
+            input_index = [p.index for p in self.pulse.source_list() if p.name == default_input][0]
+
+            if mute is None:
+                mute = not self.pulse.source_info(input_index).mute
+
+            if mute:
+                self.pulse.source_mute(input_index, True)
+            else:
+                self.pulse.source_mute(input_index, False)
@@ -0,0 +1,383 @@
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+
+
+class Backend:
+    """
+    Access to midi devices.
+    Devices are described by (interface, name, input, output, opened) tuples like pygame does,
+    and identified by their index in get_devices().
+    """
+    # Exceptions that the backend raises when a device can not be used
+    errors = ()
+    # Whether refresh() closes the devices that are open, so that they have to be opened again
+    refresh_closes_ports = False
+
+    def init(self) -> None:
+        pass
+
+    def quit(self) -> None:
+        pass
+
+    def refresh(self) -> None:
+        """ Make sure get_devices() sees devices that have been (dis)connected """
+        pass
+
+    def get_devices(self) -> [tuple]:
+        raise NotImplementedError
+
+    def open_input(self, device_id: int):
+        """
+        Returns an object with wait(timeout), poll(), read() and close() methods and device_id and wakeup attributes.
+        read() returns all available messages as (messages, timestamps) arrays, see pack().
+        If the input can notify when data arrives, it sets `wakeup` (a threading.Event, None by default) if it is
+        not None, so that one thread can wait for several inputs
+        """
+        raise NotImplementedError
+
+    def open_output(self, device_id: int):
+        """
+        Returns an object with write_short(status, data1, data2), write(events), write_sysex(data),
+        note_on(note, velocity, channel), note_off(note, velocity, channel), is_connected() and close() methods
+        and a device_id attribute
+        """
+        raise NotImplementedError
+
+
+# Lengths of the system messages that have data bytes: time code quarter frame, song position pointer and
+# song select
+_SYSTEM_LENGTHS = {0xF1: 2, 0xF2: 3, 0xF3: 2}
+
+
+def message_length(status: int) -> int:
+    """ Returns the length in bytes of a (non-SysEx) message with this status byte """
+    if status < 0xF0:
+        # Program change and channel aftertouch have one data byte
+        return 2 if status & 0xF0 in (0xC0, 0xD0) else 3
+    return _SYSTEM_LENGTHS.get(status, 1)
+
+
+def pack(status: int, data1: int = 0, data2: int = 0, data3: int = 0) -> int:
+    """
+    Pack a message into one int, in the same layout as PortMidi.
+    Batches of messages are passed around as array('I') of these, with a matching array('I') of timestamps in ms
+    """
+    return status | data1 << 8 | data2 << 16 | data3 << 24
+
+
+def pack_sysex(data: bytes) -> array:
+    """
+    Pack (part of) a SysEx message into messages of 4 bytes each, like PortMidi does, see sysex.SysexAssembler.
+    The length of the data should be a multiple of 4, unless it ends with 0xF7
+    """
+    data = bytes(data)
+    messages = array('I')
+    messages.frombytes(data + bytes(-len(data) % 4))
+    if sys.byteorder == 'big':
+        messages.byteswap()
+    return messages
+
+
+class PygameInput:
+    """
+    Reads midi input using pygame.
+    Pygame can only poll for input, so waiting is done by polling with a short sleep that grows while idle.
+    Reading is done in batches that grow while the input is busy, so bursts are read in a few calls.
+    """
+    MIN_SLEEP = 0.001
+    MAX_SLEEP = 0.05
+    MIN_BATCH = 16
+    # Pygame does not read more than 1024 events at once
+    MAX_BATCH = 1024
+
+    # Pygame can not notify, so this is never set
+    wakeup = None
+
+    def __init__(self, midi, device_id: int) -> None:
+        self.device_id = device_id
+        self._input = midi.Input(device_id)
+        self._sleep = self.MIN_SLEEP
+        self._batch = self.MIN_BATCH
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Wait until there is data to read, returns False if the timeout has passed """
+        end = None if timeout is None else time.monotonic() + timeout
+        while not self._input.poll():
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(self._sleep)
+            self._sleep = min(self._sleep * 2, self.MAX_SLEEP)
+        # Data is coming in, so poll quickly again next time
+        self._sleep = self.MIN_SLEEP
+        return True
+
+    def poll(self) -> bool:
+        """ Returns whether there is data to read, without waiting """
+        return self._input.poll()
+
+    def read(self) -> (array, array):
+        """ Returns all available (messages, timestamps), see pack() """
+        messages = array('I')
+        timestamps = array('I')
+        while True:
+            events = self._input.read(self._batch)
+            for (status, data1, data2, data3), timestamp in events:
+                messages.append(status | data1 << 8 | data2 << 16 | data3 << 24)
+                timestamps.append(timestamp & 0xFFFFFFFF)
+            if len(events) < self._batch:
+                # Everything has been read. Use smaller batches again if this one was mostly empty
+                if len(events) < self._batch // 4:
+                    self._batch = max(self._batch // 2, self.MIN_BATCH)
+                return messages, timestamps
+            # There may be more, read it in bigger batches
+            self._batch = min(self._batch * 2, self.MAX_BATCH)
+
+    def close(self) -> None:
+        self._input.close()
+
+
+class PygameOutput:
+    """ Writes midi output using pygame """
+
+    def __init__(self, midi, device_id: int) -> None:
+        self.device_id = device_id
+        self._output = midi.Output(device_id)
+        self.write_short = self._output.write_short
+        self.write = self._output.write
+        self.note_on = self._output.note_on
+        self.note_off = self._output.note_off
+
+    def write_sysex(self, data: bytes) -> None:
+        self._output.write_sys_ex(0, bytes(data))
+
+    def is_connected(self) -> bool:
+        # Send an "Active Sensing" message. If the device disconnects, this will throw an exception
+        # noinspection PyBroadException
+        try:
+            self._output.write_short(0b11111110)
+        except Exception as e:
+            # Sadly Pygame does not throw a specific Exception so we have to catch all of them :/
+            if any(x in str(e.args[0]) for x in ["PortMidi", "Bad Pointer"]):
+                return False
+        return True
+
+    def close(self) -> None:
+        self._output.close()
+
+
+class PygameBackend(Backend):
+    """ Uses pygame.midi (PortMidi), which only supports polling """
+    refresh_closes_ports = True
+
+    def __init__(self) -> None:
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+        from pygame import midi
+        self._midi = midi
+        self.errors = (midi.MidiException, )
+
+    def init(self) -> None:
+        self._midi.init()
+
+    def quit(self) -> None:
+        self._midi.quit()
+
+    def refresh(self) -> None:
+        # PortMidi only scans for devices when it is initialised
+        self._midi.quit()
+        self._midi.init()
+
+    def get_devices(self) -> [tuple]:
+        return [self._midi.get_device_info(i) for i in range(self._midi.get_count())]
+
+    def open_input(self, device_id: int) -> PygameInput:
+        return PygameInput(self._midi, device_id)
+
+    def open_output(self, device_id: int) -> PygameOutput:
+        return PygameOutput(self._midi, device_id)
+
+
+class RtMidiInput:
+    """
+    Reads midi input using python-rtmidi.
+    Messages are delivered by an rtmidi callback, so waiting blocks without polling.
+    """
+
+    def __init__(self, rtmidi, device_id: int, port: int) -> None:
+        self.device_id = device_id
+        self._messages = array('I')
+        self._timestamps = array('I')
+        self._data = threading.Condition()
+        self._time = 0
+        # Set when data arrives, see Backend.open_input
+        self.wakeup = None
+        # End of a SysEx message that was given in parts, that did not fill 4 bytes
+        self._sysex_rest = b''
+
+        self._input = rtmidi.MidiIn()
+        # SysEx is ignored by default, clock and active sensing are still ignored
+        self._input.ignore_types(sysex=False)
+        self._input.open_port(port)
+        self._input.set_callback(self._receive)
+
+    def _receive(self, message: tuple, data=None) -> None:
+        data, delta = message
+        # rtmidi gives the time since the previous message in seconds, pygame gives an absolute time in ms
+        self._time += delta * 1000
+        timestamp = int(self._time) & 0xFFFFFFFF
+        if data[0] == 0xF0 or data[0] < 0x80:
+            # SysEx, or the next part of one
+            data = (b'' if data[0] == 0xF0 else self._sysex_rest) + bytes(data)
+            cut = len(data) if data[-1] == 0xF7 else len(data) - len(data) % 4
+            data, self._sysex_rest = data[:cut], data[cut:]
+            packed = pack_sysex(data)
+            with self._data:
+                self._messages.extend(packed)
+                self._timestamps.extend(array('I', [timestamp]) * len(packed))
+                self._data.notify()
+        else:
+            if data[0] < 0xF8:
+                # Anything but a real-time message ends SysEx
+                self._sysex_rest = b''
+            packed = data[0]
+            if len(data) > 1:
+                packed |= data[1] << 8
+                if len(data) > 2:
+                    packed |= data[2] << 16
+            with self._data:
+                self._messages.append(packed)
+                self._timestamps.append(timestamp)
+                self._data.notify()
+        wakeup = self.wakeup
+        if wakeup is not None:
+            wakeup.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Wait until there is data to read, returns False if the timeout has passed """
+        with self._data:
+            return self._data.wait_for(lambda: len(self._messages) > 0, timeout)
+
+    def poll(self) -> bool:
+        """ Returns whether there is data to read, without waiting """
+        return len(self._messages) > 0
+
+    def read(self) -> (array, array):
+        """ Returns all available (messages, timestamps), see pack() """
+        with self._data:
+            messages, timestamps = self._messages, self._timestamps
+            self._messages = array('I')
+            self._timestamps = array('I')
+        return messages, timestamps
+
+    def close(self) -> None:
+        self._input.cancel_callback()
+        self._input.close_port()
+        self._input.delete()
+
+
+class RtMidiOutput:
+    """ Writes midi output using python-rtmidi """
+
+    def __init__(self, backend: 'RtMidiBackend', device_id: int, port: int) -> None:
+        self.device_id = device_id
+        self._backend = backend
+        self._name = backend.get_devices()[device_id][1]
+        self._output = backend.rtmidi.MidiOut()
+        self._output.open_port(port)
+
+    def write_short(self, status: int, data1: int = 0, data2: int = 0) -> None:
+        # rtmidi sends the message as it is given, so it should have the right amount of data bytes
+        self._output.send_message([status, data1, data2][:message_length(status)])
+
+    def write(self, events: [list]) -> None:
+        """ Write a list of [[status, data1, data2], timestamp] events, timestamps are ignored """
+        for event in events:
+            self.write_short(*event[0])
+
+    def write_sysex(self, data: bytes) -> None:
+        self._output.send_message(data)
+
+    def note_on(self, note: int, velocity: int, channel: int = 0) -> None:
+        self.write_short(0x90 + channel, note, velocity)
+
+    def note_off(self, note: int, velocity: int = 0, channel: int = 0) -> None:
+        self.write_short(0x80 + channel, note, velocity)
+
+    def is_connected(self) -> bool:
+        return any(device[1] == self._name and device[3] for device in self._backend.get_devices())
+
+    def close(self) -> None:
+        self._output.close_port()
+        self._output.delete()
+
+
+class RtMidiBackend(Backend):
+    """ Uses python-rtmidi, which delivers input with callbacks and does not need pygame """
+
+    def __init__(self) -> None:
+        import rtmidi
+        self.rtmidi = rtmidi
+        self.errors = (rtmidi.RtMidiError, )
+        # Used to list the ports, rtmidi updates these lists when devices are (dis)connected
+        self._probe_in = rtmidi.MidiIn()
+        self._probe_out = rtmidi.MidiOut()
+
+    @staticmethod
+    def _name(port: str) -> bytes:
+        # Remove the ALSA client and port number (e.g. " 20:0"), they can change when a device is reconnected
+        return re.sub(r' \d+:\d+$', '', port).encode()
+
+    def _ports(self) -> [(bool, int, str)]:
+        """ Returns (is input, port index, port name) for all ports, inputs first """
+        return [(True, i, port) for i, port in enumerate(self._probe_in.get_ports())] + \
+               [(False, i, port) for i, port in enumerate(self._probe_out.get_ports())]
+
+    def get_devices(self) -> [tuple]:
+        return [(b'rtmidi', self._name(port), int(is_input), int(not is_input), 0)
+                for is_input, i, port in self._ports()]
+
+    def open_input(self, device_id: int) -> RtMidiInput:
+        is_input, port, name = self._ports()[device_id]
+        if not is_input:
+            raise self.rtmidi.InvalidPortError(name + " is not an input")
+        return RtMidiInput(self.rtmidi, device_id, port)
+
+    def open_output(self, device_id: int) -> RtMidiOutput:
+        is_input, port, name = self._ports()[device_id]
+        if is_input:
+            raise self.rtmidi.InvalidPortError(name + " is not an output")
+        return RtMidiOutput(self, device_id, port)
+
+
+_backends = dict()
+
+
+def get_backend(name: str = None) -> Backend:
+    """
+    Returns the backend with the given name, which is only created once
+    :param name: 'rtmidi', 'pygame', or None to use rtmidi if it is installed and pygame otherwise
+    """
+    if name is None:
+        # noinspection PyBroadException
+        try:
+            return get_backend('rtmidi')
+        except Exception:
+            # rtmidi is not installed or can not access the midi system
+            return get_backend('pygame')
+
+    if name not in _backends:
+        if name == 'rtmidi':
+            _backends[name] = RtMidiBackend()
+        elif name == 'pygame':
+            _backends[name] = PygameBackend()
+        else:
+            raise ValueError("Unknown midi backend: " + name)
+    return _backends[name]
+
+
+def register_backend(name: str, backend: Backend) -> None:
+    """ Make a backend available under a name, for example to use it with Midi(backend=name) """
+    _backends[name] = backend
@@ -0,0 +1,155 @@
+import threading
+from enum import Enum
+from queue import Empty
+from typing import Iterable
+
+
+class Overflow(Enum):
+    """ What to do with new events when a subscription is full """
+    # Overwrite the oldest event that was not read yet
+    DROP_OLDEST = 0
+    # Keep the events that were not read yet
+    DROP_NEWEST = 1
+
+
+class Subscription:
+    """
+    A bounded ring buffer of events for one consumer.
+    The input loop never waits for it: when the consumer falls behind, events are dropped according to the
+    overflow policy, and counted in dropped. Only one thread should read from a subscription.
+    """
+
+    def __init__(self, bus: 'Bus', capacity: int, overflow: Overflow, accept: bytearray) -> None:
+        self.capacity = capacity
+        self.overflow = overflow
+        self._dropped = 0
+        # Indexed by status byte, 1 if events with that status are wanted
+        self._accept = accept
+        self._bus = bus
+        self._buffer = [None] * capacity
+        # Amount of events that have been written and read. Written is only changed by the input loop
+        # and read only by the consumer, so no locks are needed
+        self._written = 0
+        self._read = 0
+        # Only set when the consumer waits
+        self._waiting = False
+        self._ready = threading.Event()
+
+    def _put(self, event) -> None:
+        """ Called by the input loop """
+        written = self._written
+        if written - self._read >= self.capacity and self.overflow == Overflow.DROP_NEWEST:
+            self._dropped += 1
+            return
+        # With DROP_OLDEST, the consumer notices that it has been overtaken and skips ahead
+        self._buffer[written % self.capacity] = event
+        self._written = written + 1
+        if self._waiting:
+            self._ready.set()
+
+    def get(self, block: bool = True, timeout: float = None):
+        """
+        Returns the next event, like Queue.get
+        :raises queue.Empty: if there is no event within the timeout, or right away if block is False
+        """
+        waited = False
+        while True:
+            read = self._read
+            if self._written - read > self.capacity:
+                # Overtaken by the input loop, the oldest events have been overwritten
+                self._dropped += self._written - self.capacity - read
+                read = self._written - self.capacity
+            if read < self._written:
+                event = self._buffer[read % self.capacity]
+                if self._written - read <= self.capacity:
+                    self._read = read + 1
+                    return event
+                # It was overwritten while reading it, try again
+                self._read = read
+                continue
+
+            if not block or waited:
+                raise Empty
+            self._waiting = True
+            # Check again, so that an event that came in before _waiting was set is not missed
+            if self._written == read:
+                waited = not self._ready.wait(timeout) and timeout is not None
+            self._waiting = False
+            self._ready.clear()
+
+    def __iter__(self):
+        """ Iterates over events, waiting for new ones, until the subscription is closed """
+        while self._bus is not None:
+            try:
+                yield self.get(timeout=0.5)
+            except Empty:
+                continue
+
+    @property
+    def dropped(self) -> int:
+        """ Returns the amount of events that were lost because the subscription was full """
+        return self._dropped + max(self._written - self._read - self.capacity, 0)
+
+    def __len__(self) -> int:
+        """ Returns the amount of events that can be read now """
+        return min(self._written - self._read, self.capacity)
+
+    def close(self) -> None:
+        """ Stop receiving events """
+        if self._bus is not None:
+            self._bus.unsubscribe(self)
+            self._bus = None
+
+
+class Bus:
+    """
+    Gives every event to all subscriptions that want it.
+    Every subscription has its own buffer, so slow consumers do not hold up the input loop or each other.
+    """
+
+    def __init__(self) -> None:
+        # Replaced instead of changed, so that the input loop can use it without locking
+        self.subscriptions = ()
+        # Indexed by status byte, 1 if any subscription wants events with that status
+        self.accept = bytearray(256)
+        self._lock = threading.Lock()
+
+    def subscribe(self, capacity: int = 256, overflow: Overflow = Overflow.DROP_OLDEST, types: Iterable = None,
+                  channels: Iterable[int] = None) -> Subscription:
+        """
+        Returns a new subscription
+        :param capacity: maximum amount of events to keep while they are not read
+        :param overflow: what to do when it is full
+        :param types: Midi.Types to receive, None for all
+        :param channels: channels (1-16) to receive, None for all
+        """
+        accept = bytearray(256)
+        type_values = None if types is None else {t.value for t in types}
+        channels = None if channels is None else set(channels)
+        for status in range(0x80, 0xF0):
+            if ((type_values is None or (status >> 4) - 8 in type_values) and
+                    (channels is None or (status & 0x0F) + 1 in channels)):
+                accept[status] = 1
+        subscription = Subscription(self, capacity, overflow, accept)
+        with self._lock:
+            self.subscriptions = self.subscriptions + (subscription, )
+            self._update()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+            self._update()
+
+    def _update(self) -> None:
+        accept = bytearray(256)
+        for subscription in self.subscriptions:
+            for status in range(256):
+                accept[status] |= subscription._accept[status]
+        self.accept = accept
+
+    def publish(self, status: int, event) -> None:
+        """ Called by the input loop with every event """
+        for subscription in self.subscriptions:
+            if subscription._accept[status]:
+                subscription._put(event)
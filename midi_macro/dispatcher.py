@@ -0,0 +1,312 @@
+import functools
+import threading
+import time
+import traceback
+from collections import deque
+from enum import Enum
+from typing import Callable, Hashable
+
+from midi_macro.stats import Stats
+
+# Flag of the code of coroutine functions (inspect.CO_COROUTINE)
+CO_COROUTINE = 0x80
+
+
+def iscoroutinefunction(function: Callable) -> bool:
+    """ Returns whether a function is a coroutine function (async def), without importing asyncio or inspect """
+    while isinstance(function, functools.partial):
+        function = function.func
+    code = getattr(function, '__code__', None)
+    return code is not None and bool(code.co_flags & CO_COROUTINE)
+
+
+class Backpressure(Enum):
+    """ What to do when a handler already has `max_pending` calls waiting """
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEWEST = 2
+
+
+class Dispatcher:
+    """ Base class for objects that run midi event handlers """
+
+    def __init__(self) -> None:
+        # Amount of calls that were replaced by a newer call, in total and per handler
+        self.coalesced = 0
+        self.coalesced_per_handler = dict()
+        # Amount of calls that were dropped because of backpressure
+        self.dropped = 0
+        # Collects timing statistics of calls that are submitted without stats
+        self.stats = None
+
+    def submit(self, function: Callable[[tuple], None], args: tuple, key: Hashable = None,
+               received: float = None, stats: Stats = None) -> None:
+        """
+        Run a function with the given arguments
+        :param function: the function to run
+        :param args: the argument to pass to the function
+        :param key: if set, a waiting call to the same function with the same key is replaced by this one
+        :param received: time.perf_counter() of when the midi message was read, for statistics
+        :param stats: where to record the timing of this call, defaults to self.stats. Every Midi object passes
+            its own, so that devices can share a dispatcher
+        """
+        raise NotImplementedError
+
+    def pending(self) -> int:
+        """ Returns the amount of calls that are waiting to run """
+        return 0
+
+    def _submitted(self, received: float, stats: Stats) -> (float, float, Stats):
+        """ Returns (received, submitted) times and the stats of the call, and records the dispatch time """
+        submitted = time.perf_counter()
+        if stats is None:
+            stats = self.stats
+        if received is None:
+            received = submitted
+        elif stats is not None:
+            stats.add_dispatch(received, submitted)
+        return received, submitted, stats
+
+    def _call(self, function: Callable[[tuple], None], args: tuple, received: float, submitted: float,
+              stats: Stats) -> None:
+        started = time.perf_counter()
+        # noinspection PyBroadException
+        try:
+            function(args)
+        except Exception:
+            # A failing handler should not take the worker down with it
+            traceback.print_exc()
+        if stats is not None:
+            stats.add_call(function, received, submitted, started, time.perf_counter())
+
+    def _count_coalesced(self, function: Callable[[tuple], None]) -> None:
+        self.coalesced += 1
+        self.coalesced_per_handler[function] = self.coalesced_per_handler.get(function, 0) + 1
+
+    def close(self) -> None:
+        pass
+
+
+class ThreadDispatcher(Dispatcher):
+    """ Runs every handler call in a new daemon thread (the original behaviour) """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        # Coalesced calls that are running, mapped to the newest call that is waiting (or None)
+        self._active = dict()
+
+    def submit(self, function: Callable[[tuple], None], args: tuple, key: Hashable = None,
+               received: float = None, stats: Stats = None) -> None:
+        call = (args, ) + self._submitted(received, stats)
+        if key is not None:
+            key = (function, key)
+            with self._lock:
+                if key in self._active:
+                    if self._active[key] is not None:
+                        self._count_coalesced(function)
+                    self._active[key] = call
+                    return
+                self._active[key] = None
+
+        t = threading.Thread(target=self._run, args=(function, call, key))
+        t.daemon = True
+        t.start()
+
+    def _run(self, function: Callable[[tuple], None], call: tuple, key: Hashable) -> None:
+        while True:
+            self._call(function, *call)
+            if key is None:
+                return
+            with self._lock:
+                # Run again with the newest values if they came in while running
+                call = self._active[key]
+                if call is None:
+                    self._active.pop(key)
+                    return
+                self._active[key] = None
+
+
+class PoolDispatcher(Dispatcher):
+    """
+    Runs handlers on a fixed number of worker threads.
+    Every handler has its own queue, so calls to the same handler run one at a time and in order,
+    while different handlers can run in parallel.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 64,
+                 backpressure: Backpressure = Backpressure.DROP_OLDEST) -> None:
+        """
+        :param workers: amount of worker threads
+        :param max_pending: maximum amount of waiting calls per handler
+        :param backpressure: what to do with new calls when a handler has `max_pending` calls waiting
+        """
+        super().__init__()
+        self.max_pending = max_pending
+        self.backpressure = backpressure
+
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # Pending calls per handler, as [key, args, received, submitted, stats] lists
+        self._pending = dict()
+        # Pending calls per (handler, key), for calls that can be coalesced
+        self._pending_keys = dict()
+        # Handlers that have pending calls and are not running
+        self._ready_handlers = deque()
+        self._running = True
+
+        self._workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name="Midi dispatcher " + str(i))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def submit(self, function: Callable[[tuple], None], args: tuple, key: Hashable = None,
+               received: float = None, stats: Stats = None) -> None:
+        received, submitted, stats = self._submitted(received, stats)
+        with self._lock:
+            if key is not None:
+                call = self._pending_keys.get((function, key))
+                if call is not None:
+                    # Replace the values of the call that is still waiting
+                    call[1:] = args, received, submitted, stats
+                    self._count_coalesced(function)
+                    return
+
+            pending = self._pending.get(function)
+            if pending is None:
+                pending = self._pending[function] = deque()
+                self._ready_handlers.append(function)
+                self._ready.notify()
+
+            if len(pending) >= self.max_pending:
+                if self.backpressure == Backpressure.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.backpressure == Backpressure.DROP_OLDEST:
+                    self._forget(function, pending.popleft())
+                    self.dropped += 1
+                else:
+                    while self._running and len(pending) >= self.max_pending:
+                        self._not_full.wait()
+                    # The handler may have been finished while we were waiting
+                    pending = self._pending.get(function)
+                    if pending is None:
+                        pending = self._pending[function] = deque()
+                        self._ready_handlers.append(function)
+                        self._ready.notify()
+
+            call = [key, args, received, submitted, stats]
+            pending.append(call)
+            if key is not None:
+                self._pending_keys[(function, key)] = call
+
+    def _forget(self, function: Callable[[tuple], None], call: list) -> None:
+        """ Stop tracking a call that is no longer waiting """
+        if call[0] is not None:
+            self._pending_keys.pop((function, call[0]), None)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while self._running and not self._ready_handlers:
+                    self._ready.wait()
+                if not self._running:
+                    return
+                function = self._ready_handlers.popleft()
+                call = self._pending[function].popleft()
+                self._forget(function, call)
+                self._not_full.notify_all()
+
+            self._call(function, *call[1:])
+
+            with self._lock:
+                if self._pending[function]:
+                    # More calls are waiting for this handler, put it back in line
+                    self._ready_handlers.append(function)
+                    self._ready.notify()
+                else:
+                    self._pending.pop(function)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def close(self) -> None:
+        with self._lock:
+            self._running = False
+            self._ready.notify_all()
+            self._not_full.notify_all()
+
+
+class AsyncioDispatcher(Dispatcher):
+    """
+    Runs coroutine functions (async def) as tasks on an asyncio event loop.
+    Tasks are much lighter than threads, so many calls can wait for I/O at the same time.
+    """
+
+    def __init__(self, loop: 'asyncio.AbstractEventLoop' = None) -> None:
+        """
+        :param loop: the event loop to use, a new one is started in its own thread if not set
+        """
+        super().__init__()
+        self._own_loop = loop is None
+        if loop is None:
+            # Only imported when needed, because importing asyncio takes a while
+            import asyncio
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="Midi asyncio")
+            thread.daemon = True
+            thread.start()
+        self.loop = loop
+        # Coalesced calls that are running, mapped to the newest call that is waiting (or None).
+        # Only used from the event loop
+        self._active = dict()
+        self._tasks = 0
+
+    def submit(self, function: Callable[[tuple], None], args: tuple, key: Hashable = None,
+               received: float = None, stats: Stats = None) -> None:
+        call = (args, ) + self._submitted(received, stats)
+        self.loop.call_soon_threadsafe(self._start, function, call, key)
+
+    def _start(self, function: Callable[[tuple], None], call: tuple, key: Hashable) -> None:
+        if key is not None:
+            key = (function, key)
+            if key in self._active:
+                if self._active[key] is not None:
+                    self._count_coalesced(function)
+                self._active[key] = call
+                return
+            self._active[key] = None
+        self._tasks += 1
+        self.loop.create_task(self._run(function, call, key))
+
+    async def _run(self, function: Callable[[tuple], None], call: tuple, key: Hashable) -> None:
+        while True:
+            args, received, submitted, stats = call
+            started = time.perf_counter()
+            # noinspection PyBroadException
+            try:
+                await function(args)
+            except Exception:
+                traceback.print_exc()
+            if stats is not None:
+                stats.add_call(function, received, submitted, started, time.perf_counter())
+            if key is not None:
+                # Run again with the newest values if they came in while running
+                call = self._active[key]
+                if call is not None:
+                    self._active[key] = None
+                    continue
+                self._active.pop(key)
+            self._tasks -= 1
+            return
+
+    def pending(self) -> int:
+        return self._tasks
+
+    def close(self) -> None:
+        if self._own_loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,73 @@
+class MidiEvent:
+    """
+    A midi event as given to the queue and to Midi.events().
+    Unpacks and indexes like a (channel, type, value1, value2, timestamp) tuple,
+    `device` is the name of the device it came from.
+    Hashes like that tuple as well, but events from an EventRing are changed when they are reused, so copy() them
+    before keeping them in a set or as a dict key.
+    """
+    __slots__ = ('channel', 'type', 'value1', 'value2', 'timestamp', 'device')
+
+    def __init__(self, channel: int, m_type, value1: int, value2: int, timestamp: int, device: str = None) -> None:
+        self.channel = channel
+        self.type = m_type
+        self.value1 = value1
+        self.value2 = value2
+        self.timestamp = timestamp
+        self.device = device
+
+    def __iter__(self):
+        return iter((self.channel, self.type, self.value1, self.value2, self.timestamp))
+
+    def __getitem__(self, index):
+        """ Indexes like the (channel, type, value1, value2, timestamp) tuple that the queue used to get """
+        return (self.channel, self.type, self.value1, self.value2, self.timestamp)[index]
+
+    def __len__(self) -> int:
+        return 5
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (MidiEvent, tuple)):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self) -> int:
+        # Defining __eq__ removes the default hash, events were hashable before
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return "MidiEvent({}, {}, {}, {}, {})".format(self.channel, self.type, self.value1, self.value2,
+                                                      self.timestamp)
+
+    def copy(self) -> 'MidiEvent':
+        return MidiEvent(self.channel, self.type, self.value1, self.value2, self.timestamp, self.device)
+
+
+class EventRing:
+    """
+    A fixed amount of MidiEvent objects that are reused in turn, so that no objects are created per event.
+    An event is overwritten `capacity` events later, so consumers that keep events or fall further behind
+    should copy() them.
+    """
+    __slots__ = ('_events', '_index')
+
+    def __init__(self, capacity: int = 256) -> None:
+        self._events = [MidiEvent(0, None, 0, 0, 0) for _ in range(capacity)]
+        self._index = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def next(self, channel: int, m_type, value1: int, value2: int, timestamp: int, device: str = None) -> MidiEvent:
+        """ Returns the oldest event object, filled with these values """
+        event = self._events[self._index]
+        self._index += 1
+        if self._index == len(self._events):
+            self._index = 0
+        event.channel = channel
+        event.type = m_type
+        event.value1 = value1
+        event.value2 = value2
+        event.timestamp = timestamp
+        event.device = device
+        return event
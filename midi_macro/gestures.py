@@ -0,0 +1,248 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+
+class Timer:
+    """ A function call scheduled by a Scheduler """
+    __slots__ = ('deadline', 'order', 'function', 'args')
+
+    def __init__(self, deadline: float, order: int, function: Callable, args: tuple) -> None:
+        self.deadline = deadline
+        self.order = order
+        self.function = function
+        self.args = args
+
+    def __lt__(self, other: 'Timer') -> bool:
+        return (self.deadline, self.order) < (other.deadline, other.order)
+
+    def cancel(self) -> None:
+        self.function = None
+
+
+class Scheduler:
+    """ Runs delayed function calls from a heap of timers, using a single thread """
+
+    def __init__(self, lock: threading.RLock = None) -> None:
+        """
+        :param lock: if set, timers run while holding this lock, and timers that are cancelled while
+            holding it are guaranteed not to run
+        """
+        self._lock = lock
+        self._timers = []
+        self._order = itertools.count()
+        self._changed = threading.Condition()
+        self._running = True
+        thread = threading.Thread(target=self._run, name="Midi timers")
+        thread.daemon = True
+        thread.start()
+
+    def call_later(self, delay: float, function: Callable, *args) -> Timer:
+        timer = Timer(time.monotonic() + delay, next(self._order), function, args)
+        with self._changed:
+            heapq.heappush(self._timers, timer)
+            if self._timers[0] is timer:
+                # The earliest timer changed, so the thread should wake up at another time
+                self._changed.notify()
+        return timer
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while self._running:
+                    if not self._timers:
+                        self._changed.wait()
+                        continue
+                    delay = self._timers[0].deadline - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._changed.wait(delay)
+                if not self._running:
+                    return
+                timer = heapq.heappop(self._timers)
+
+            if self._lock is None:
+                if timer.function is not None:
+                    timer.function(*timer.args)
+            else:
+                with self._lock:
+                    if timer.function is not None:
+                        timer.function(*timer.args)
+
+    def close(self) -> None:
+        with self._changed:
+            self._running = False
+            self._changed.notify()
+
+
+class Gesture:
+    """
+    Base class for gestures on one or more notes of a channel.
+    Like with add_event, functions get a (note, velocity) tuple: that of the note that completed the gesture.
+    """
+
+    def __init__(self, channel: int, notes: Iterable[int]) -> None:
+        self.channel = channel
+        self.notes = tuple(notes)
+        # Set by GestureEngine.add
+        self._scheduler = None
+        self._fire = None
+
+    def press(self, note: int, velocity: int) -> None:
+        pass
+
+    def release(self, note: int) -> None:
+        pass
+
+
+class Taps(Gesture):
+    """
+    Runs a different function depending on how many times a note is tapped.
+    The count is final when no tap follows within `timeout` seconds, or when the highest count is reached,
+    so if only single taps are mapped they run without any delay.
+    """
+
+    def __init__(self, channel: int, note: int, functions: Dict[int, Callable[[tuple], None]],
+                 timeout: float = 0.3) -> None:
+        """
+        :param channel: midi channel
+        :param note: the note to tap
+        :param functions: tap count -> function
+        :param timeout: maximum seconds between taps
+        """
+        super().__init__(channel, (note, ))
+        self.functions = functions
+        self.timeout = timeout
+        self._max_count = max(functions)
+        self._count = 0
+        self._timer = None
+
+    def press(self, note: int, velocity: int) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._count += 1
+        if self._count >= self._max_count:
+            self._finish((note, velocity))
+        else:
+            self._timer = self._scheduler.call_later(self.timeout, self._finish, (note, velocity))
+
+    def _finish(self, values: tuple) -> None:
+        function = self.functions.get(self._count)
+        self._count = 0
+        self._timer = None
+        if function is not None:
+            self._fire(function, values)
+
+
+class LongPress(Gesture):
+    """ Runs a function when a note is held for `duration` seconds, and optionally another one when it is not """
+
+    def __init__(self, channel: int, note: int, function: Callable[[tuple], None], duration: float = 0.5,
+                 short_press: Callable[[tuple], None] = None) -> None:
+        """
+        :param channel: midi channel
+        :param note: the note to hold
+        :param function: runs when the note has been held for `duration` seconds
+        :param duration: seconds
+        :param short_press: runs when the note is released earlier
+        """
+        super().__init__(channel, (note, ))
+        self.function = function
+        self.duration = duration
+        self.short_press = short_press
+        self._values = None
+        self._timer = None
+
+    def press(self, note: int, velocity: int) -> None:
+        if self._timer is not None:
+            # Pressed again without a release in between, the hold starts over
+            self._timer.cancel()
+        self._values = (note, velocity)
+        self._timer = self._scheduler.call_later(self.duration, self._held)
+
+    def _held(self) -> None:
+        self._timer = None
+        self._fire(self.function, self._values)
+
+    def release(self, note: int) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            if self.short_press is not None:
+                self._fire(self.short_press, self._values)
+
+
+class Chord(Gesture):
+    """ Runs a function when all notes are held, and were pressed within `window` seconds of each other """
+
+    def __init__(self, channel: int, notes: Iterable[int], function: Callable[[tuple], None],
+                 window: float = 0.05) -> None:
+        super().__init__(channel, notes)
+        self.function = function
+        self.window = window
+        # Note -> time it was pressed, for notes that are held
+        self._held = dict()
+
+    def press(self, note: int, velocity: int) -> None:
+        now = time.monotonic()
+        self._held[note] = now
+        if len(self._held) == len(self.notes) and now - min(self._held.values()) <= self.window:
+            self._fire(self.function, (note, velocity))
+
+    def release(self, note: int) -> None:
+        self._held.pop(note, None)
+
+
+class GestureEngine:
+    """ Feeds note messages to gestures """
+
+    def __init__(self, fire: Callable[[Callable[[tuple], None], tuple], None]) -> None:
+        """
+        :param fire: called with (function, values) when a gesture is completed
+        """
+        self._fire = fire
+        self._scheduler = None
+        # Gestures run from both the midi thread and the timer thread
+        self._lock = threading.RLock()
+        # (channel, note) -> gestures
+        self._gestures = dict()
+
+    def add(self, gesture: Gesture) -> None:
+        if self._scheduler is None:
+            # Gestures are only used while holding the lock, so they do not need their own
+            self._scheduler = Scheduler(self._lock)
+        gesture._scheduler = self._scheduler
+        gesture._fire = self._fire
+        with self._lock:
+            for note in gesture.notes:
+                self._gestures.setdefault((gesture.channel, note), []).append(gesture)
+
+    def remove(self, gesture: Gesture) -> None:
+        with self._lock:
+            for note in gesture.notes:
+                self._gestures.get((gesture.channel, note), []).remove(gesture)
+
+    def feed(self, status: int, value1: int, value2: int) -> None:
+        """ Handle a midi message, only note on and note off messages are used """
+        kind = status & 0xF0
+        if kind != NOTE_ON and kind != NOTE_OFF:
+            return
+        gestures = self._gestures.get(((status & 0x0F) + 1, value1))
+        if not gestures:
+            return
+        with self._lock:
+            for gesture in gestures:
+                # A note on with velocity 0 is a note off
+                if kind == NOTE_ON and value2 > 0:
+                    gesture.press(value1, value2)
+                else:
+                    gesture.release(value1)
+
+    def close(self) -> None:
+        if self._scheduler is not None:
+            self._scheduler.close()
@@ -0,0 +1,199 @@
+"""
+Combining the messages of high resolution controls into single 14 bit events:
+- CC_14: controller n (0-31) sends the most significant 7 bits, controller n + 32 the least significant 7 bits
+- NRPN and RPN: controllers 99 and 98 (NRPN) or 101 and 100 (RPN) choose a parameter, then data entry
+  (controller 6 and 38) sets its value, and data increment and decrement (96 and 97) change it by 1
+- PITCH_WHEEL_14: the two values of a pitch wheel message as one value
+
+Functions get (number, value) tuples, with the controller or parameter number (0 for pitch wheel) and the 14 bit value.
+An event is given when the least significant part arrives, so a change that takes two or four messages calls
+the function once. Until a control has sent a least significant part, its most significant part is given at the end
+of the batch of messages it was read in, so controls that only send that still work.
+Controllers 6 and 38 are data entry, so they are not used for CC_14.
+"""
+import threading
+from typing import Callable, Iterable, Union
+
+# The values of these types in Midi.Type
+CC_14 = 8
+NRPN = 9
+RPN = 10
+PITCH_WHEEL_14 = 11
+TYPES = (CC_14, NRPN, RPN, PITCH_WHEEL_14)
+
+CONTROL_CHANGE = 0xB0
+PITCH_WHEEL = 0xE0
+DATA_MSB = 6
+DATA_LSB = 38
+DATA_INCREMENT = 96
+DATA_DECREMENT = 97
+NRPN_LSB = 98
+NRPN_MSB = 99
+RPN_LSB = 100
+RPN_MSB = 101
+# Parameter number that deselects the parameter
+NULL = 0x3FFF
+
+Numbers = Union[int, Iterable[int], Callable[[int], bool]]
+
+
+def numbers_list(m_type: int, numbers: Numbers) -> [int]:
+    """ Returns the numbers that match as a list, -1 for any number """
+    top = 31 if m_type == CC_14 else 0 if m_type == PITCH_WHEEL_14 else NULL
+    if isinstance(numbers, int):
+        numbers = [numbers]
+    elif callable(numbers):
+        numbers = [n for n in range(top + 1) if numbers(n)]
+    numbers = list(numbers)
+    for number in numbers:
+        if number != -1 and not 0 <= number <= top:
+            raise ValueError("Numbers of this type are between 0 and " + str(top) + ", not " + str(number))
+    return numbers
+
+
+class Channel:
+    """ What has been received on a channel so far """
+    __slots__ = ('msb', 'lsb_seen', 'parameter_type', 'parameter_msb', 'parameter', 'data', 'data_lsb_seen')
+
+    def __init__(self) -> None:
+        # Most significant part of controllers 0-31, and whether the least significant part has been received
+        self.msb = [0] * 32
+        self.lsb_seen = [False] * 32
+        # NRPN or RPN, and the number of the parameter that data entry changes, None if none is chosen
+        self.parameter_type = None
+        self.parameter_msb = 0
+        self.parameter = None
+        # (type, parameter) -> value
+        self.data = dict()
+        # (type, parameter) of parameters that have received the least significant data entry part
+        self.data_lsb_seen = set()
+
+
+class Assembler:
+    """ Combines the control change and pitch wheel messages of a Midi object into 14 bit events """
+
+    def __init__(self) -> None:
+        # (channel, type, number) -> handler, number -1 for any number
+        self._added = dict()
+        self._mapped = dict()
+        # Both together, replaced instead of changed so that the input loop can use it without locking
+        self._routes = dict()
+        # Indexed by status byte, 1 if messages with that status are needed
+        self.statuses = bytearray(256)
+        self._channels = [Channel() for _ in range(16)]
+        self._lock = threading.Lock()
+        # (channel, type, number) -> (value, received) of most significant parts that may get a least significant
+        # part, see flush()
+        self.pending = dict()
+        # Messages that were used, and events that were given
+        self.messages = 0
+        self.events = 0
+
+    def add(self, handler, channel: int, m_type: int, numbers: Numbers = -1) -> None:
+        with self._lock:
+            for number in numbers_list(m_type, numbers):
+                self._added[(channel, m_type, number)] = handler
+            self._update()
+
+    def remove(self, channel: int, m_type: int, numbers: Numbers = -1) -> None:
+        with self._lock:
+            for number in numbers_list(m_type, numbers):
+                self._added.pop((channel, m_type, number), None)
+            self._update()
+
+    def set_mapping(self, mapping: [tuple]) -> None:
+        """
+        Replace the handlers of the previous mapping, they override handlers that were added for the same number
+        :param mapping: (handler, channel, type, numbers) tuples
+        """
+        mapped = dict()
+        for handler, channel, m_type, numbers in mapping:
+            for number in numbers_list(m_type, numbers):
+                mapped[(channel, m_type, number)] = handler
+        with self._lock:
+            self._mapped = mapped
+            self._update()
+
+    def _update(self) -> None:
+        routes = dict(self._added)
+        routes.update(self._mapped)
+        statuses = bytearray(256)
+        for channel, m_type, _ in routes:
+            statuses[(PITCH_WHEEL if m_type == PITCH_WHEEL_14 else CONTROL_CHANGE) | channel - 1] = 1
+        self._routes = routes
+        self.statuses = statuses
+
+    def feed(self, status: int, value1: int, value2: int, received: float) -> None:
+        """ Handle a control change or pitch wheel message, called by the input loop """
+        channel = (status & 0x0F) + 1
+        if status & 0xF0 == PITCH_WHEEL:
+            self.messages += 1
+            self._fire(channel, PITCH_WHEEL_14, 0, value2 << 7 | value1, received)
+            return
+
+        state = self._channels[channel - 1]
+        if value1 == DATA_MSB or value1 == DATA_LSB or value1 == DATA_INCREMENT or value1 == DATA_DECREMENT:
+            if state.parameter is None:
+                return
+            self.messages += 1
+            key = (state.parameter_type, state.parameter)
+            value = state.data.get(key, 0)
+            if value1 == DATA_MSB:
+                value = value2 << 7 | value & 0x7F
+                state.data[key] = value
+                if key not in state.data_lsb_seen:
+                    self.pending[(channel, ) + key] = (value, received)
+                return
+            elif value1 == DATA_LSB:
+                value = value & 0x3F80 | value2
+                state.data_lsb_seen.add(key)
+                self.pending.pop((channel, ) + key, None)
+            elif value1 == DATA_INCREMENT:
+                value = min(value + 1, 0x3FFF)
+            else:
+                value = max(value - 1, 0)
+            state.data[key] = value
+            self._fire(channel, state.parameter_type, state.parameter, value, received)
+        elif value1 < 32:
+            # Most significant part, wait for the least significant part if this controller sends it
+            self.messages += 1
+            state.msb[value1] = value2
+            if not state.lsb_seen[value1]:
+                self.pending[(channel, CC_14, value1)] = (value2 << 7, received)
+        elif value1 < 64:
+            self.messages += 1
+            value1 -= 32
+            state.lsb_seen[value1] = True
+            self.pending.pop((channel, CC_14, value1), None)
+            self._fire(channel, CC_14, value1, state.msb[value1] << 7 | value2, received)
+        elif value1 == NRPN_MSB or value1 == RPN_MSB:
+            self.messages += 1
+            state.parameter_type = NRPN if value1 == NRPN_MSB else RPN
+            state.parameter_msb = value2
+            state.parameter = None
+        elif value1 == NRPN_LSB or value1 == RPN_LSB:
+            self.messages += 1
+            parameter_type = NRPN if value1 == NRPN_LSB else RPN
+            if state.parameter_type == parameter_type:
+                parameter = state.parameter_msb << 7 | value2
+                state.parameter = None if parameter == NULL else parameter
+
+    def flush(self) -> None:
+        """
+        Give the most significant parts that did not get a least significant part,
+        called by the input loop after every batch of messages
+        """
+        pending, self.pending = self.pending, dict()
+        for (channel, m_type, number), (value, received) in pending.items():
+            self._fire(channel, m_type, number, value, received)
+
+    def _fire(self, channel: int, m_type: int, number: int, value: int, received: float) -> None:
+        routes = self._routes
+        handler = routes.get((channel, m_type, number))
+        if handler is None:
+            handler = routes.get((channel, m_type, -1))
+            if handler is None:
+                return
+        self.events += 1
+        key = (channel, m_type, number) if handler.coalesce else None
+        handler.dispatcher.submit(handler.function, (number, value), key, received, handler.stats)
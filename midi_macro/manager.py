@@ -0,0 +1,188 @@
+import threading
+import time
+from typing import Callable
+from queue import Queue
+
+from midi_macro.backends import get_backend
+from midi_macro.bus import Bus
+from midi_macro.dispatcher import Dispatcher, PoolDispatcher
+from midi_macro.midi import Midi, get_devices
+from midi_macro.monitor import get_monitor
+
+
+class MidiManager(threading.Thread):
+    """
+    Reads the input of several midi devices in a single thread.
+    Every device is a Midi object with its own routing table, so the amount of devices does not change
+    how long it takes to find the function for a message. Functions of all devices share one dispatcher.
+    """
+    # Seconds without input after which we check if the devices are still connected
+    IDLE_TIMEOUT = 0.5
+    # Sleep between polls while there are devices that can not notify when data arrives (pygame)
+    MIN_SLEEP = 0.001
+    MAX_SLEEP = 0.05
+    # Minimum seconds between refreshes that close all devices (pygame), when the device monitor can not
+    # notice changes
+    REFRESH_INTERVAL = 5.0
+
+    def __init__(self, queue: Queue = None, dispatcher: Dispatcher = None, backend: str = None) -> None:
+        """
+        :param queue: queue that gets a MidiEvent for every event of every device, see MidiEvent.device
+        :param dispatcher: runs the functions of all devices, defaults to a PoolDispatcher
+        :param backend: 'rtmidi' or 'pygame', see backends.get_backend
+        """
+        super().__init__(name="Midi devices")
+        self.queue = queue
+        # Events of all devices, use bus.subscribe() to receive them, see Midi.subscribe and MidiEvent.device
+        self.bus = Bus()
+        self.dispatcher = dispatcher if dispatcher is not None else PoolDispatcher()
+        self.backend = backend
+        self._backend = get_backend(backend)
+        # Set by inputs when data arrives
+        self.wakeup = threading.Event()
+        # Device name -> Midi
+        self.devices = dict()
+        # Replaced instead of changed, so that the loop can use it without locking
+        self._midis = ()
+        self._lock = threading.Lock()
+        # Only one device refreshes the backend at a time, see refresh()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = None
+        self._running = True
+        self.daemon = True
+        self.start()
+
+    def open(self, input_id: int, output_id: int, name: str = None, **kwargs) -> Midi:
+        """
+        Open a device, arguments are passed to Midi
+        :param name: name to find the device by, defaults to the name of the device
+        """
+        midi = Midi(input_id, output_id, self.queue, self.dispatcher, self.backend, manager=self, bus=self.bus,
+                    **kwargs)
+        if name is not None:
+            midi.device_name = name
+        with self._lock:
+            duplicate = midi.device_name in self.devices
+            if not duplicate:
+                self.devices[midi.device_name] = midi
+                self._midis = tuple(self.devices.values())
+        if duplicate:
+            midi.close()
+            raise ValueError("There already is a device named " + midi.device_name + ", pass another name")
+        self.wakeup.set()
+        return midi
+
+    def remove(self, midi: Midi) -> None:
+        """ Stop reading a device, this is done by Midi.close """
+        with self._lock:
+            if self.devices.get(midi.device_name) is midi:
+                self.devices.pop(midi.device_name)
+            self._midis = tuple(self.devices.values())
+
+    def __getitem__(self, device: str) -> Midi:
+        return self.devices[device]
+
+    def add_event(self, device: str, function: Callable[[tuple], None], channel: int, midi_type: Midi.Type,
+                  value1: int = None, value2: int = None, coalesce: bool = False, **kwargs) -> None:
+        """ Run a function on a midi event of a device, other arguments (e.g. priority) are passed to Midi.add_event """
+        self.devices[device].add_event(function, channel, midi_type, value1, value2, coalesce, **kwargs)
+
+    def remove_event(self, device: str, channel: int, midi_type: Midi.Type, value1: int = None,
+                     value2: int = None) -> None:
+        self.devices[device].remove_event(channel, midi_type, value1, value2)
+
+    def run(self) -> None:
+        sleep = self.MIN_SLEEP
+        last_check = time.monotonic()
+        while self._running:
+            # Clear before reading, so that data that arrives while reading is not missed
+            self.wakeup.clear()
+            busy = False
+            polling = False
+            for midi in self._midis:
+                if not midi.connected:
+                    continue
+                midi_in = midi._midi_in
+                if midi_in.wakeup is None:
+                    polling = True
+                try:
+                    if midi_in.poll():
+                        midi._handle(*midi_in.read())
+                        busy = True
+                except (NameError, AttributeError, RuntimeError):
+                    # The device has been closed
+                    pass
+                except self._backend.errors:
+                    pass
+
+            if busy:
+                sleep = self.MIN_SLEEP
+                continue
+
+            now = time.monotonic()
+            if now - last_check >= self.IDLE_TIMEOUT:
+                last_check = now
+                self._check_connections()
+
+            if polling:
+                self.wakeup.wait(sleep)
+                sleep = min(sleep * 2, self.MAX_SLEEP)
+            else:
+                self.wakeup.wait(self.IDLE_TIMEOUT)
+
+    def _check_connections(self) -> None:
+        for midi in self._midis:
+            if not midi.connected:
+                continue
+            try:
+                lost = midi._connection_lost()
+            except self._backend.errors:
+                lost = True
+            if lost:
+                self._start_reconnect(midi)
+
+    def _start_reconnect(self, midi: Midi) -> None:
+        # Reconnect in another thread, so that the other devices keep working
+        midi.connected = False
+        t = threading.Thread(target=self._reconnect, args=(midi, ), name="Midi reconnect")
+        t.daemon = True
+        t.start()
+
+    def refresh(self, midi: Midi) -> None:
+        """
+        Refresh the device list of the backend for a device that is reconnecting, see Backend.refresh.
+        With pygame this closes all devices, so the other devices are opened again
+        """
+        with self._refresh_lock:
+            if not self._backend.refresh_closes_ports:
+                self._backend.refresh()
+                return
+            now = time.monotonic()
+            if (not get_monitor().reliable and self._last_refresh is not None and
+                    now - self._last_refresh < self.REFRESH_INTERVAL):
+                return
+            self._last_refresh = now
+            others = [other for other in self._midis if other is not midi and other.connected]
+            for other in others:
+                # Stop reading them while their ports are closed
+                other.connected = False
+            self._backend.refresh()
+            devices = get_devices(False, self.backend, cached=False)
+            for other in others:
+                if not other._reopen(devices):
+                    # It was unplugged as well
+                    self._start_reconnect(other)
+        self.wakeup.set()
+
+    def _reconnect(self, midi: Midi) -> None:
+        midi._reconnect()
+        # Read anything that arrived while reconnecting
+        self.wakeup.set()
+
+    def close(self) -> None:
+        self._running = False
+        self.wakeup.set()
+        for midi in self._midis:
+            midi.close()
+        self.dispatcher.close()
+        self._backend.quit()
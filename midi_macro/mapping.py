@@ -0,0 +1,172 @@
+"""
+Mappings from midi events to functions, read from a JSON or TOML file:
+
+    [[events]]
+    function = "knob_1_7"   # name of a function of the handlers object
+    channel = 1             # a channel, or a list of channels
+    type = "CC"             # name of a Midi.Type, e.g. "NRPN", see highres
+    value1 = 7              # a value, an inclusive [first, last] range, or left out for any value
+    value2 = [1, 127]
+    coalesce = true
+    priority = 1            # wins over events with a lower priority that match the same messages
+    scale = [0.0, 1.0]      # give the function value2 scaled from 0-127 to this range instead
+    invert = true           # reverse value2 (before scaling)
+    curve = "log"           # "linear", "log" or "exp"
+    dead_zone = 2           # treat values up to this as 0
+    hysteresis = 2          # ignore changes smaller than this
+    smoothing = 0.5         # give a moving average of value2, see transforms.Transform
+"""
+import json
+import os
+import threading
+import time
+from enum import Enum
+from typing import Union
+
+from midi_macro.transforms import Transform
+
+
+class MappingError(ValueError):
+    pass
+
+
+def read_mapping(path: str) -> [dict]:
+    """ Returns the event entries of a mapping file, the format is chosen by the file extension """
+    with open(path, 'rb') as file:
+        if path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                # Python < 3.11
+                import tomli as tomllib
+            data = tomllib.load(file)
+        else:
+            data = json.load(file)
+    events = data.get('events', [])
+    if not isinstance(events, list):
+        raise MappingError("'events' should be a list")
+    return events
+
+
+def _values(entry: dict, key: str, top: int = 127) -> Union[int, range]:
+    """ Returns the values that an entry matches, -1 for any value """
+    value = entry.get(key)
+    if value is None:
+        return -1
+    if isinstance(value, int):
+        values = range(value, value + 1)
+    elif isinstance(value, list) and len(value) == 2:
+        values = range(value[0], value[1] + 1)
+    else:
+        raise MappingError(key + " should be a value or a [first, last] range, not " + repr(value))
+    if not values or not all(0 <= v <= top for v in values):
+        raise MappingError(key + " should be between 0 and " + str(top) + ", not " + repr(value))
+    return value if isinstance(value, int) else values
+
+
+def _channels(entry: dict) -> [int]:
+    channels = entry['channel']
+    if isinstance(channels, int):
+        channels = [channels]
+    if not isinstance(channels, list) or not channels or not all(isinstance(c, int) and 1 <= c <= 16
+                                                                  for c in channels):
+        raise MappingError("channel should be a channel or a list of channels between 1 and 16, not " +
+                           repr(entry['channel']))
+    return channels
+
+
+TRANSFORM_KEYS = ('curve', 'scale', 'invert', 'dead_zone', 'hysteresis', 'smoothing', 'steepness')
+
+
+def _transform(entry: dict) -> Union[Transform, None]:
+    """ Returns the value2 transform of an entry, or None if it has none """
+    options = {key: entry[key] for key in TRANSFORM_KEYS if key in entry}
+    if not options:
+        return None
+    scale = options.get('scale')
+    if scale is not None and not (isinstance(scale, list) and len(scale) == 2):
+        raise MappingError("scale should be a [minimum, maximum] range, not " + repr(scale))
+    try:
+        return Transform(**options)
+    except ValueError as e:
+        raise MappingError(str(e))
+
+
+def compile_mapping(entries: [dict], handlers: Union[object, dict], types: Enum) -> [tuple]:
+    """
+    Returns (function, channels, type, value1, value2, coalesce, priority) tuples,
+    like the arguments of Midi.add_event with -1 for any value
+    :param entries: see read_mapping
+    :param handlers: object or dict that has the functions that the entries name
+    :param types: the Midi.Type enum
+    """
+    rules = []
+    for i, entry in enumerate(entries):
+        try:
+            name = entry['function']
+            function = handlers[name] if isinstance(handlers, dict) else getattr(handlers, name)
+            channels = _channels(entry)
+            m_type = types[entry['type']]
+            # The parameter number of NRPN and RPN events has 14 bits
+            values1 = _values(entry, 'value1', 16383 if m_type.name in ('NRPN', 'RPN') else 127)
+            values2 = _values(entry, 'value2')
+            priority = entry.get('priority', 0)
+            if not isinstance(priority, int):
+                raise MappingError("priority should be a number, not " + repr(priority))
+            transform = _transform(entry)
+        except (KeyError, AttributeError, TypeError) as e:
+            raise MappingError("Event {}: missing or unknown {}".format(i, e))
+        except MappingError as e:
+            raise MappingError("Event {}: {}".format(i, e))
+
+        coalesce = entry.get('coalesce', False)
+        if transform is None:
+            rules.append((function, channels, m_type, values1, values2, coalesce, priority))
+        else:
+            # Every channel has its own hysteresis and smoothing state
+            for c in channels:
+                rules.append((transform.wrap(function, m_type.name), c, m_type, values1, values2, coalesce, priority))
+    return rules
+
+
+def load_mapping(midi, path: str, handlers: Union[object, dict]) -> None:
+    """ Read a mapping file and use it for a Midi object, see Midi.set_mapping """
+    midi.set_mapping(compile_mapping(read_mapping(path), handlers, type(midi).Type))
+
+
+class MappingWatcher:
+    """ Loads a mapping file into a Midi object, and loads it again every time the file changes """
+    # Seconds between checks of the modification time
+    INTERVAL = 1
+
+    def __init__(self, midi, path: str, handlers: Union[object, dict]) -> None:
+        self.midi = midi
+        self.path = path
+        self.handlers = handlers
+        self._mtime = None
+        self._running = True
+        # Load it now, so that errors in the file are raised
+        self._load()
+        t = threading.Thread(target=self._watch, name="Midi mapping watcher")
+        t.daemon = True
+        t.start()
+
+    def _load(self) -> None:
+        self._mtime = os.stat(self.path).st_mtime_ns
+        load_mapping(self.midi, self.path, self.handlers)
+
+    def _watch(self) -> None:
+        while self._running:
+            time.sleep(self.INTERVAL)
+            # noinspection PyBroadException
+            try:
+                if os.stat(self.path).st_mtime_ns == self._mtime:
+                    continue
+                self._load()
+                print("Reloaded " + self.path)
+            except Exception as e:
+                # Keep the previous mapping until the file is fixed
+                print("Could not load {}: {}".format(self.path, e))
+
+    def close(self) -> None:
+        self._running = False
@@ -1,42 +1,96 @@
-import os
 import threading
+from array import array
 import time
 from enum import Enum
-from typing import Callable
+from typing import Callable, Iterable, Union
 from queue import Queue
 
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-from pygame import midi
+from midi_macro.backends import get_backend
+from midi_macro.bus import Bus, Overflow, Subscription
+from midi_macro.dispatcher import AsyncioDispatcher, Dispatcher, PoolDispatcher, iscoroutinefunction
+from midi_macro.events import EventRing, MidiEvent
+from midi_macro import highres
+from midi_macro.gestures import Gesture, GestureEngine
+from midi_macro.mapping import MappingWatcher, load_mapping
+from midi_macro.monitor import get_monitor
+from midi_macro.output import OutputQueue, OutputState
+from midi_macro.recording import Recorder
+from midi_macro.routing import Rule, RoutingTable, Values
+from midi_macro.stats import Stats, format_stats
+from midi_macro.sysex import SysexAssembler
+from midi_macro.transforms import Transform
+
+
+# Backend -> (device monitor generation, devices) of the last time the devices were listed, see get_devices
+_devices = dict()
+
+
+def get_devices(pygame_init=True, backend: str = None, cached: bool = True) -> [tuple]:
+    """
+    Returns a list of midi devices
+    :param pygame_init: initialise the backend before and quit it after listing
+    :param backend: name of the backend to use, see backends.get_backend
+    :param cached: return the previous list if the device monitor has not noticed any changes since then.
+        Listing devices with pygame needs a slow initialisation of PortMidi. Without a reliable monitor the devices
+        are always listed again
+    """
+    backend = get_backend(backend)
+    monitor = get_monitor()
+    generation = monitor.generation
+    previous = _devices.get(backend)
+    if cached and previous is not None and not monitor.changed_since(previous[0]):
+        return list(previous[1])
 
-
-def get_devices(pygame_init=True) -> [tuple]:
-    """ Returns a list of midi devices """
     if pygame_init:
-        midi.init()
-    result = []
-    for i in range(midi.get_count()):
-        result.append(midi.get_device_info(i))
+        backend.init()
+    result = backend.get_devices()
     if pygame_init:
-        midi.quit()
-    return result
+        backend.quit()
+    _devices[backend] = (generation, result)
+    return list(result)
 
 
-def print_devices() -> None:
+def print_devices(backend: str = None) -> None:
     """ Prints a nicely formatted list of midi devices """
-    devices = get_devices()
+    devices = get_devices(backend=backend)
     for i, device in enumerate(devices):
         print(str(i) + ": " + device[0].decode() + " " + device[1].decode() + ", " + ("input" if device[2] else "") +
               ("output" if device[3] else "") + ", " + ("in use" if device[4] else "not in use"))
 
 
-def get_id_pair(io_id: int) -> (int, int):
+def get_id_pair(io_id: int, backend: str = None) -> (int, int):
     """ Returns an input and output id based on either an input or an output"""
-    devices = get_devices()
+    devices = get_devices(backend=backend)
     in_id = [i for i, device in enumerate(devices) if device[1] == devices[io_id][1] and device[2]][0]
     out_id = [i for i, device in enumerate(devices) if device[1] == devices[io_id][1] and device[3]][0]
     return in_id, out_id
 
 
+def _channels(channels: Union[int, Iterable[int]]) -> Iterable[int]:
+    return (channels, ) if isinstance(channels, int) else channels
+
+
+def _put_nowait(queue: 'asyncio.Queue', event: tuple) -> None:
+    """ Put an event in an asyncio queue, if it is not full """
+    if not queue.full():
+        queue.put_nowait(event)
+
+
+class Handler:
+    """
+    A function that is mapped to a midi event, with its options, the dispatcher that runs it and the stats of
+    its device, which are given with every call because devices can share a dispatcher
+    """
+    __slots__ = ('function', 'coalesce', 'dispatcher', 'stats')
+
+    def __init__(self, function: Callable[[tuple], None], dispatcher: Dispatcher, coalesce: bool = False,
+                 stats: Stats = None) -> None:
+        self.function = function
+        self.dispatcher = dispatcher
+        self.coalesce = coalesce
+        self.stats = stats
+
+
 class Midi(threading.Thread):
     class Type(Enum):
         NOTE_OFF = 0
@@ -46,65 +100,215 @@ class Midi(threading.Thread):
         PROGRAM_CHANGE = 4
         CHANNEL_AFTERTOUCH = 5
         PITCH_WHEEL = 6
-
-    def _init_map(self) -> dict:
+        # Combined from several messages, see highres
+        CC_14 = highres.CC_14
+        NRPN = highres.NRPN
+        RPN = highres.RPN
+        PITCH_WHEEL_14 = highres.PITCH_WHEEL_14
+
+    # Seconds without input after which we check if the device is still connected
+    IDLE_TIMEOUT = 0.5
+
+    def __init__(self, input_id: int = None, output_id: int = None, queue: Queue = None,
+                 dispatcher: Dispatcher = None, backend: str = None, stats_interval: float = None,
+                 loop: 'asyncio.AbstractEventLoop' = None, event_ring: int = None, manager=None,
+                 bus: Bus = None, process_dispatcher: Dispatcher = None) -> None:
         """
-        Create nested dicts for channel, type, value1, value2
+        :param input_id: id of the input device, asks for a device if not set
+        :param output_id: id of the output device, asks for a device if not set
+        :param queue: queue that gets a MidiEvent for every event, which unpacks like a
+            (channel, type, value1, value2, timestamp) tuple. The timestamp is the time in ms given by the backend.
+            The queue is not bounded, use subscribe() for consumers that may fall behind
+        :param dispatcher: runs the functions that are mapped to events, defaults to a PoolDispatcher
+        :param backend: 'rtmidi' or 'pygame', defaults to rtmidi if it is installed, see backends.get_backend
+        :param stats_interval: if set, print stats() every this many seconds
+        :param loop: event loop to run coroutine functions (async def) on, a new one is started if needed and not set
+        :param event_ring: if set, reuse this many MidiEvent objects for the queue and events() instead of
+            creating one per event, see events.EventRing
+        :param manager: a MidiManager that reads the input of this device in its own thread, instead of starting
+            a thread for this device. Use MidiManager.open to create managed devices
+        :param bus: bus to publish events on, see subscribe(). Only one thread may publish on a bus,
+            so it can only be shared by devices of the same manager
+        :param process_dispatcher: runs the functions that are added with process=True, defaults to a
+            process.ProcessDispatcher that is created when it is first needed
         """
-        c_dict = dict()
-        for channel in range(1, 16):
-            t_dict = dict()
-            for m_type in self.Type:
-                v1_dict = dict()
-                for value1 in range(0, 127):
-                    v2_dict = dict()
-                    v1_dict[value1] = v2_dict
-                t_dict[m_type] = v1_dict
-            c_dict[channel] = t_dict
-        return c_dict
-
-    def __init__(self, input_id: int = None, output_id: int = None, queue: Queue = None) -> None:
         super().__init__()
         self.queue = queue
-        self.try_to_reconnect = False
-
-        if input_id is not None and output_id is not None:
-            midi.init()
-            self._midi_in = midi.Input(input_id)
-            self._midi_out = midi.Output(output_id)
-        else:
-            print_devices()  # List devices
-            midi_io_ids = get_id_pair(int(input("Choose a midi device: ")))  # Ask for device
-            midi.init()
-            self._midi_in = midi.Input(midi_io_ids[0])
-            self._midi_out = midi.Output(midi_io_ids[1])
-
-        midi_devices = get_devices(False)
+        # Runs the functions that are mapped to events
+        self.dispatcher = dispatcher if dispatcher is not None else PoolDispatcher()
+        # Given with every call, the dispatchers may be shared with other devices
+        self._stats = Stats()
+        # Runs coroutine functions, created when the first one is added
+        self._loop = loop
+        self._async_dispatcher = None
+        # Runs functions in worker processes, created when the first one is added if not set, see add_event
+        self._process_dispatcher = process_dispatcher
+        # (event loop, asyncio.Queue) pairs of running events() iterators
+        self._listeners = []
+        self._event_ring = EventRing(event_ring) if event_ring is not None else None
+        # Gives events to subscriptions, see subscribe()
+        self.bus = bus if bus is not None else Bus()
+        # Set while recording, see record()
+        self._recorder = None
+        self.backend = backend
+        self._backend = get_backend(backend)
+        # False while the device is unplugged
+        self.connected = True
+        self._monitor = get_monitor()
+        self._monitor_generation = self._monitor.generation
+        self._manager = manager
+        # Set by the input when data arrives, so that the manager can wait for all of its devices at once
+        self._wakeup = manager.wakeup if manager is not None else None
+
+        if input_id is None or output_id is None:
+            print_devices(backend)  # List devices
+            input_id, output_id = get_id_pair(int(input("Choose a midi device: ")), backend)  # Ask for device
+        self._backend.init()
+        self._midi_in = self._backend.open_input(input_id)
+        self._midi_in.wakeup = self._wakeup
+        self._midi_out = self._backend.open_output(output_id)
+
+        midi_devices = get_devices(False, backend)
         self._midi_in_name = midi_devices[self._midi_in.device_id]
         self._midi_out_name = midi_devices[self._midi_out.device_id]
-
-        self._channel_map = self._init_map()
+        self.device_name = self._midi_in_name[1].decode()
+        # Output is written by a separate thread, in batches
+        self.output = OutputQueue(lambda: self._midi_out)
+        # LEDs and motor faders, only changes are sent
+        self.state = OutputState(self.output)
+
+        # Events that were added with add_event
+        self._added = RoutingTable()
+        # (channel, type, rule) of the events from the mapping, see set_mapping
+        self._mapping = []
+        # Both together, the table that the input loop uses. Without a mapping it is the table of add_event
+        self._routes = self._added
+        self._mapping_watcher = None
+        self._routes_lock = threading.Lock()
+        # Created when the first gesture is added
+        self._gestures = None
+        # Created when the first 14 bit event is added
+        self._assembler = None
+        # Created when the first SysEx function is added
+        self._sysex = None
         self._running = True
-        self.start()
-
-    def wait_for_reconnect(self):
-        while True:
-            time.sleep(0.2)
-            # Refresh pygame midi
-            midi.quit()
-            midi.init()
+        if manager is None:
+            self.start()
+
+        if stats_interval is not None:
+            self._start_stats_dump(stats_interval)
+
+    def stats(self) -> dict:
+        """
+        Returns statistics about received messages and handler timing, see stats.Stats.
+        Latencies are summarised as {'count', 'mean', 'p50', 'p99', 'max'} dicts, in seconds.
+        """
+        stats = self._stats.snapshot()
+        dispatchers = [d for d in (self.dispatcher, self._async_dispatcher, self._process_dispatcher) if d is not None]
+        stats['dropped'] = sum(d.dropped for d in dispatchers)
+        stats['coalesced'] = sum(d.coalesced for d in dispatchers)
+        stats['queue_depth'] = sum(d.pending() for d in dispatchers)
+        return stats
+
+    def _start_stats_dump(self, interval: float) -> None:
+        def dump():
+            while self._running:
+                time.sleep(interval)
+                print(format_stats(self.stats()))
+
+        t = threading.Thread(target=dump, name="Midi stats")
+        t.daemon = True
+        t.start()
+
+    def wait_for_reconnect(self) -> [int]:
+        """
+        Wait until the device is connected again, and return its new input and output IDs.
+        The device list is only scanned again when the device monitor notices a change.
+        Returns None if the Midi object is closed while waiting
+        """
+        generation = self._monitor.generation
+        refreshed = None
+        while self._running:
+            # Refresh the device list, when something has changed since the last time
+            if refreshed is None or self._monitor.changed_since(refreshed):
+                refreshed = self._monitor.generation
+                if self._manager is not None:
+                    # Refreshing may close the other devices of the manager
+                    self._manager.refresh(self)
+                else:
+                    self._backend.refresh()
             # Check if the device is back in the list
-            devices = get_devices()
-            device_names = [device[1] for device in devices]
-            if self._midi_in_name[1] in device_names:
+            devices = [self._ignore_in_use(device) for device in get_devices(False, self.backend, cached=False)]
+            midi_in_name = self._ignore_in_use(self._midi_in_name)
+            midi_out_name = self._ignore_in_use(self._midi_out_name)
+            if midi_in_name in devices and midi_out_name in devices:
                 # Return the new IDs
-                return [self.get_device_index(self._midi_in_name), self.get_device_index(self._midi_out_name)]
+                return [devices.index(midi_in_name), devices.index(midi_out_name)]
+            # Use a timeout so that close() is noticed
+            generation = self._monitor.wait(generation, 1)
+
+    def _reconnect(self) -> None:
+        """ Reopen the device after it has been unplugged, keeping all functions and state """
+        print("\nTrying to reconnect...")
+        self.connected = False
+        for port in (self._midi_in, self._midi_out):
+            # noinspection PyBroadException
+            try:
+                port.close()
+            except Exception:
+                # The port is already broken
+                pass
+
+        while self._running:
+            ids = self.wait_for_reconnect()
+            if ids is None:
+                return
+            try:
+                self._midi_in = self._backend.open_input(ids[0])
+                self._midi_in.wakeup = self._wakeup
+                self._midi_out = self._backend.open_output(ids[1])
+            except self._backend.errors:
+                # It disappeared again
+                continue
+            self.connected = True
+            # The device has probably lost its LED state
+            self.state.resend()
+            print("Reconnected")
+            return
+
+    def _reopen(self, devices: [tuple]) -> bool:
+        """
+        Open the ports again after the backend closed them, see Backend.refresh_closes_ports
+        :param devices: the current device list
+        :return: whether the device was found
+        """
+        self.connected = False
+        for port in (self._midi_in, self._midi_out):
+            # noinspection PyBroadException
+            try:
+                port.close()
+            except Exception:
+                # The backend has already closed it
+                pass
+        devices = [self._ignore_in_use(device) for device in devices]
+        midi_in_name = self._ignore_in_use(self._midi_in_name)
+        midi_out_name = self._ignore_in_use(self._midi_out_name)
+        if midi_in_name not in devices or midi_out_name not in devices:
+            return False
+        try:
+            self._midi_in = self._backend.open_input(devices.index(midi_in_name))
+            self._midi_in.wakeup = self._wakeup
+            self._midi_out = self._backend.open_output(devices.index(midi_out_name))
+        except self._backend.errors:
+            return False
+        self.connected = True
+        return True
 
     @staticmethod
-    def get_device_index(device_name) -> int:
+    def get_device_index(device_name, backend: str = None) -> int:
         # Set 'in use' parameter to 0 because it is not important in this case
         device_name = Midi._ignore_in_use(device_name)
-        devices = [Midi._ignore_in_use(device) for device in get_devices()]
+        devices = [Midi._ignore_in_use(device) for device in get_devices(backend=backend)]
         # Return the index
         return devices.index(device_name)
 
@@ -117,122 +321,347 @@ class Midi(threading.Thread):
     def set_queue(self, queue: Queue):
         self.queue = queue
 
+    def subscribe(self, capacity: int = 256, overflow: Overflow = Overflow.DROP_OLDEST, types: Iterable[Type] = None,
+                  channels: Union[int, Iterable[int]] = None) -> Subscription:
+        """
+        Returns a subscription that gets a MidiEvent for every event of the given types and channels:
+            subscription = midi.subscribe(types=[Midi.Type.CC], channels=1)
+            for channel, m_type, value1, value2, timestamp in subscription:
+        Every subscription has its own bounded buffer, so a slow consumer never holds up the input or other
+        consumers, it loses events instead (see Subscription.dropped). Call close() on it to stop receiving events.
+        :param capacity: maximum amount of events to keep while they are not read
+        :param overflow: what to do with new events when it is full
+        :param types: Midi.Types to receive, None for all
+        :param channels: channel or channels (1-16) to receive, None for all
+        """
+        if channels is not None:
+            channels = _channels(channels)
+        return self.bus.subscribe(capacity, overflow, types, channels)
+
     def get_io_ids(self) -> (int, int):
         return self._midi_in.device_id, self._midi_out.device_id
 
+    def _connection_lost(self) -> bool:
+        """ Returns whether the device has been disconnected, only checks after devices have changed """
+        if self._running and self._monitor.changed_since(self._monitor_generation):
+            self._monitor_generation = self._monitor.generation
+            return not self._midi_out.is_connected()
+        return False
+
     def run(self) -> None:
-        quick_mode = True
         while self._running:
             try:
-                # Quick mode is used so that when there is no data coming, we can disable it as to
-                # not hog the CPU by midi.poll()ing every cycle.
-                # However, when there is more data coming after a poll we don't want to wait
-                # because that would cause a lot of lag, for example when a knob is turned.
-                # Thus, if there is more data queued, we disable quick mode and keep polling
-                if not quick_mode:
-                    # If we are not in quick mode: wait before proceeding
-                    time.sleep(0.05)
-                elif not self._midi_in.poll():
-                    # If we are in quick mode but there is no data: disable quick mode
-                    quick_mode = False
-
-                # Send an "Active Sensing" message. If the device disconnects, this will throw an exception
-                # noinspection PyBroadException
-                try:
-                    self._midi_out.write_short(0b11111110)
-                except Exception as e:
-                    # Sadly Pygame does not throw a specific Exception so we have to catch all of them :/
-                    if any(x in str(e.args[0]) for x in ["PortMidi", "Bad Pointer"]):
-                        self.try_to_reconnect = True
-                        return
-
-                if self._midi_in.poll():
-                    # If there is data, enable quick mode
-                    quick_mode = True
-
-                    events = self._midi_in.read(10)
-                    for event in events:
-                        event = event[0]
-                        status = event[0]
-                        if status not in range(128, 239):
-                            continue
-
-                        channel = (status - 127) % 16
-                        m_type_int = (status - 128) // 16
-                        m_type = self.Type(m_type_int)
-                        value1 = event[1]
-                        value2 = event[2]
-
-                        if self.queue is not None:
-                            self.queue.put((channel, m_type, value1, value2))
-
-                        function = self._get_event(channel, m_type, value1, value2)
-                        if function is not None:
-                            t = threading.Thread(target=function, args=((value1, value2), ))
-                            t.setDaemon(True)
-                            t.start()
+                # Block until input arrives, without a fixed sleep
+                if not self._midi_in.wait(self.IDLE_TIMEOUT):
+                    if self._connection_lost():
+                        self._reconnect()
+                    continue
+
+                # Read everything that is available at once
+                self._handle(*self._midi_in.read())
             except (NameError, AttributeError, RuntimeError):
                 # traceback.print_exc()
                 return
-            except midi.MidiException:
+            except self._backend.errors:
                 pass
 
+    def _handle(self, messages: array, timestamps: array) -> None:
+        """ Handle messages that have been read, see backends.pack() """
+        received = time.perf_counter()
+        # Read once, stop_recording() may set it to None from another thread
+        recorder = self._recorder
+        if recorder is not None:
+            recorder.add(messages, timestamps)
+        stats = self._stats
+        stats.received += len(messages)
+        types = _TYPES
+        bus = self.bus
+        sysex = self._sysex
+        for message, timestamp in zip(messages, timestamps):
+            status = message & 0xFF
+            m_type = types[status]
+            if m_type is None:
+                if sysex is None or not sysex.feed(message, received):
+                    stats.ignored += 1
+                continue
+            if sysex is not None and sysex.active:
+                # A SysEx message ends at the next status byte
+                sysex.abort()
+
+            value1 = message >> 8 & 0x7F
+            value2 = message >> 16 & 0x7F
+
+            if self.queue is not None or self._listeners or bus.accept[status]:
+                if self._event_ring is not None:
+                    event = self._event_ring.next(_CHANNELS[status], m_type, value1, value2, timestamp,
+                                                  self.device_name)
+                else:
+                    event = MidiEvent(_CHANNELS[status], m_type, value1, value2, timestamp, self.device_name)
+                if self.queue is not None:
+                    self.queue.put(event)
+                for loop, queue in self._listeners:
+                    loop.call_soon_threadsafe(_put_nowait, queue, event)
+                bus.publish(status, event)
+
+            if self._gestures is not None:
+                self._gestures.feed(status, value1, value2)
+            if self._assembler is not None and self._assembler.statuses[status]:
+                self._assembler.feed(status, value1, value2, received)
+
+            handler = self._routes.get(status, value1, value2)
+            if handler is None:
+                stats.unmatched += 1
+            elif handler.coalesce:
+                # Only the newest values for this control are kept while the function is busy: the status and value1,
+                # or only the status for program change, channel aftertouch and pitch wheel, where value1 is a value
+                key = message & 0xFF if status >= 0xC0 else message & 0x7FFF
+                handler.dispatcher.submit(handler.function, _VALUES[value1 << 7 | value2], key, received, stats)
+            else:
+                handler.dispatcher.submit(handler.function, _VALUES[value1 << 7 | value2], None, received, stats)
+        if self._assembler is not None and self._assembler.pending:
+            self._assembler.flush()
+
     def close(self) -> None:
         try:
             self._running = False
+            self.output.close()
             self._midi_in.close()
             self._midi_out.close()
-            midi.quit()
+            if self._async_dispatcher is not None:
+                self._async_dispatcher.close()
+            if self._process_dispatcher is not None:
+                self._process_dispatcher.close()
+            if self._gestures is not None:
+                self._gestures.close()
+            if self._mapping_watcher is not None:
+                self._mapping_watcher.close()
+            self.stop_recording()
+            if self._manager is not None:
+                # The dispatcher and backend are shared with the other devices of the manager
+                self._manager.remove(self)
+                return
+            self.dispatcher.close()
+            self._backend.quit()
         except(NameError, AttributeError, RuntimeError):
             pass
 
-    def add_event(self, function: Callable[[tuple], None], channel: int, midi_type: Type,
-                  value1: int = None, value2: int = None) -> None:
-        name = "Midi listener for " + str(channel) + " " + str(midi_type)
-
-        if value1 is None:
-            self._channel_map[channel][midi_type][-1] = function
-        elif value2 is None:
-            name += " " + str(value1)
-            self._channel_map[channel][midi_type][value1][-1] = function
+    def add_event(self, function: Callable[[tuple], None], channel: Union[int, Iterable[int]], midi_type: Type,
+                  value1: Values = None, value2: Values = None, coalesce: bool = False, priority: int = 0,
+                  process: bool = False, transform: Transform = None) -> None:
+        """
+        Run a function on a midi event
+        :param function: function that gets a (value1, value2) tuple. Coroutine functions (async def)
+            run on an asyncio event loop instead of a worker thread
+        :param channel: midi channel, or several channels (e.g. [1, 2] or range(1, 17))
+        :param midi_type: midi message type. CC_14, NRPN, RPN and PITCH_WHEEL_14 combine the messages of high
+            resolution controls, and give the function (number, value) with a 14 bit value, see highres
+        :param value1: first value (e.g. note or controller number), None for all. Can also be several values
+            (e.g. range(1, 7)) or a function that returns whether a value matches (e.g. lambda v: v > 64).
+            For the combined types it is the controller or parameter number
+        :param value2: second value (e.g. velocity), like value1. Not used for the combined types
+        :param coalesce: if the function is still running or waiting for the same channel, type and value1
+            (only channel and type for program change, channel aftertouch and pitch wheel), replace the waiting
+            values instead of adding another call. Useful for knobs and faders where only the last value matters.
+            The amount of replaced calls is counted in `dispatcher.coalesced`
+        :param priority: if several events match a message, the one with the highest priority is used.
+            With the same priority the one with the fewest value1s is used, then the one with the fewest value2s,
+            then the one that was added last
+        :param process: run the function in a worker process, for functions that take a lot of CPU time or may
+            hang or crash, see process.ProcessDispatcher. The function must be picklable
+        :param transform: curve, scaling and smoothing to apply to value2 before it is given to the function,
+            see transforms.Transform. For PITCH_WHEEL the 14 bit value is transformed and given as value2,
+            for the combined types the 14 bit value is transformed. Every channel gets its own transformed
+            function with its own hysteresis and smoothing, so calls for different channels can run at the same time
+        """
+        channels = list(_channels(channel))
+        dispatcher = self._get_dispatcher(function, process)
+        if transform is None:
+            handlers = [Handler(function, dispatcher, coalesce, self._stats)] * len(channels)
         else:
-            name += " " + str(value1) + " " + str(value2)
-            self._channel_map[channel][midi_type][value1][value2] = function
-
-    def remove_event(self, channel: int, midi_type: Type, value1: int = None, value2: int = None) -> None:
-        try:
-            self._channel_map[channel][midi_type][value1].pop(value2)
+            handlers = [Handler(transform.wrap(function, midi_type.name), dispatcher, coalesce, self._stats)
+                        for _ in channels]
+        if midi_type.value in highres.TYPES:
+            if value2 is not None or priority:
+                raise ValueError("value2 and priority can not be used with " + midi_type.name)
+            for c, handler in zip(channels, handlers):
+                self._get_assembler().add(handler, c, midi_type.value, -1 if value1 is None else value1)
             return
-        except KeyError:
-            pass
-        try:
-            self._channel_map[channel][midi_type][value1].pop(-1)
-            return
-        except KeyError:
-            pass
-        try:
-            self._channel_map[channel][midi_type].pop(-1)
+        with self._routes_lock:
+            for c, handler in zip(channels, handlers):
+                self._added.add(handler, c, midi_type.value, -1 if value1 is None else value1,
+                                -1 if value2 is None else value2, priority)
+            if self._mapping:
+                self._update_routes()
+
+    def remove_event(self, channel: Union[int, Iterable[int]], midi_type: Type, value1: Values = None,
+                     value2: Values = None) -> None:
+        """ Remove the most specific function that was mapped to the given event with add_event """
+        if midi_type.value in highres.TYPES:
+            if self._assembler is not None:
+                for c in _channels(channel):
+                    self._assembler.remove(c, midi_type.value, -1 if value1 is None else value1)
             return
-        except KeyError:
-            pass
+        with self._routes_lock:
+            for c in _channels(channel):
+                self._added.remove(c, midi_type.value, -1 if value1 is None else value1,
+                                   -1 if value2 is None else value2)
+            if self._mapping:
+                self._update_routes()
+
+    def set_mapping(self, rules: [tuple]) -> None:
+        """
+        Replace the functions of the previous mapping, see mapping.compile_mapping.
+        A new table is built next to the one in use and then swapped in, so incoming events are not delayed.
+        Events from the mapping override events that were added with add_event for exactly the same values,
+        those are kept and used again when the mapping no longer has them
+        :param rules: (function, channels, type, value1, value2, coalesce, priority) tuples
+        """
+        mapping = []
+        high_resolution = []
+        for function, channels, m_type, value1, value2, coalesce, priority in rules:
+            handler = Handler(function, self._get_dispatcher(function), coalesce, self._stats)
+            for c in _channels(channels):
+                if m_type.value in highres.TYPES:
+                    high_resolution.append((handler, c, m_type.value, value1))
+                else:
+                    mapping.append((c, m_type.value, Rule(handler, value1, value2, priority)))
+        if high_resolution or self._assembler is not None:
+            self._get_assembler().set_mapping(high_resolution)
+
+        with self._routes_lock:
+            self._mapping = mapping
+            self._update_routes()
+
+    def _update_routes(self) -> None:
+        """ Combine the events of add_event and of the mapping into the table that the input loop uses """
+        if not self._mapping:
+            routes = self._added
+        else:
+            routes = RoutingTable()
+            for c, m_type, rule in self._added.rules() + self._mapping:
+                routes.add_rule(rule, c, m_type, resolve=False)
+            routes.resolve()
+        # Replacing the attribute is atomic, the input loop uses either the old or the new table
+        self._routes = routes
+
+    def load_mapping(self, path: str, handlers, watch: bool = True) -> None:
+        """
+        Map functions to events using a JSON or TOML file, see mapping.py for the format
+        :param path: path of the file
+        :param handlers: object or dict with the functions that the file names, e.g. a Functions object
+        :param watch: load the file again when it changes
+        """
+        if self._mapping_watcher is not None:
+            self._mapping_watcher.close()
+            self._mapping_watcher = None
+        if watch:
+            self._mapping_watcher = MappingWatcher(self, path, handlers)
+        else:
+            load_mapping(self, path, handlers)
 
-    def _get_event(self, channel: int, midi_type: Type,
-                   value1: int = None, value2: int = None) -> Callable[[tuple], None]:
-        try:
-            return self._channel_map[channel][midi_type][value1][value2]
-        except KeyError:
-            pass
-        try:
-            return self._channel_map[channel][midi_type][value1][-1]
-        except KeyError:
-            pass
+    def add_sysex(self, function: Callable[[memoryview], None], prefix: bytes = b'') -> None:
+        """
+        Run a function on SysEx messages that start with the given bytes
+        :param function: function that gets the whole message, from 0xF0 to 0xF7, as a memoryview.
+            The memoryview is not changed afterwards, so it can be kept
+        :param prefix: the bytes after 0xF0, usually the manufacturer id and some header bytes
+            (e.g. b'\\x00\\x20\\x29' for Novation). Empty for all messages. The longest matching prefix is used
+        """
+        if self._sysex is None:
+            self._sysex = SysexAssembler()
+        self._sysex.add(Handler(function, self._get_dispatcher(function), stats=self._stats), prefix)
+
+    def remove_sysex(self, prefix: bytes = b'') -> None:
+        if self._sysex is not None:
+            self._sysex.remove(prefix)
+
+    def _get_assembler(self) -> highres.Assembler:
+        if self._assembler is None:
+            self._assembler = highres.Assembler()
+        return self._assembler
+
+    def _get_dispatcher(self, function: Callable[[tuple], None], process: bool = False) -> Dispatcher:
+        """ Returns the dispatcher that should run a function """
+        if process:
+            if iscoroutinefunction(function):
+                raise ValueError("Coroutine functions can not run in a worker process")
+            # Only imported when needed, because importing multiprocessing takes a while
+            import pickle
+            from midi_macro.process import ProcessDispatcher
+            # Fail now instead of in the worker
+            pickle.dumps(function)
+            if self._process_dispatcher is None:
+                self._process_dispatcher = ProcessDispatcher()
+            return self._process_dispatcher
+        if not iscoroutinefunction(function):
+            return self.dispatcher
+        if self._async_dispatcher is None:
+            self._async_dispatcher = AsyncioDispatcher(self._loop)
+        return self._async_dispatcher
+
+    def _run_function(self, function: Callable[[tuple], None], values: tuple) -> None:
+        self._get_dispatcher(function).submit(function, values, stats=self._stats)
+
+    async def events(self, maxsize: int = 0):
+        """
+        Asynchronous iterator over (channel, type, value1, value2, timestamp) tuples of incoming events:
+            async for channel, m_type, value1, value2, timestamp in midi.events():
+        :param maxsize: maximum amount of events to keep while the iterator is not read, newer events are dropped
+            if it is full. 0 for no maximum
+        """
+        import asyncio
+        listener = (asyncio.get_running_loop(), asyncio.Queue(maxsize))
+        self._listeners.append(listener)
         try:
-            return self._channel_map[channel][midi_type][-1]
-        except KeyError:
-            pass
+            while True:
+                yield await listener[1].get()
+        finally:
+            self._listeners.remove(listener)
+
+    def record(self, path: str) -> None:
+        """
+        Write all received messages to a file, until stop_recording() is called.
+        The file can be replayed without a device using recording.ReplayBackend
+        """
+        self.stop_recording()
+        self._recorder = Recorder(path)
+
+    def stop_recording(self) -> None:
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    def add_gesture(self, gesture: Gesture) -> None:
+        """
+        Run functions on note gestures, see gestures.Taps, gestures.LongPress and gestures.Chord.
+        Timing is done by a single timer thread, no threads wait for gestures to complete.
+        """
+        if self._gestures is None:
+            self._gestures = GestureEngine(self._run_function)
+        self._gestures.add(gesture)
+
+    def remove_gesture(self, gesture: Gesture) -> None:
+        if self._gestures is not None:
+            self._gestures.remove(gesture)
+
+    def send(self, status: int, data1: int = 0, data2: int = 0) -> None:
+        """ Write a midi message, see output.OutputQueue """
+        self.output.put(status, data1, data2)
+
+    def send_sysex(self, data: bytes) -> None:
+        """ Write a SysEx message, from 0xF0 to 0xF7 """
+        self.output.put_sysex(data)
 
     def note_out(self, channel: int, note: int, on: bool = True):
+        """ Write a note on or note off message, the channel starts at 0 """
         if on:
-            self._midi_out.note_on(note, 127, channel)
+            self.output.put(0x90 | channel, note, 127)
         else:
-            self._midi_out.note_off(note, 0, channel)
+            self.output.put(0x80 | channel, note, 0)
+
+
+# Decoded channel and type of every status byte, the type is None for messages that are not channel messages
+_CHANNELS = [(status & 0x0F) + 1 for status in range(256)]
+_TYPES = [Midi.Type((status >> 4) - 8) if 0x80 <= status <= 0xEF else None for status in range(256)]
+# The (value1, value2) tuple for every pair of values, indexed by value1 << 7 | value2
+_VALUES = [(value1, value2) for value1 in range(128) for value2 in range(128)]
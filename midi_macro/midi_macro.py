@@ -1,22 +1,26 @@
 from threading import Thread
-
-import PySimpleGUI as sg
 from queue import Queue
 
 from midi_macro import midi
+from midi_macro.dispatcher import Dispatcher, PoolDispatcher
 
 
 class MidiMacro(Thread):
-    def __init__(self, functions: type, queue=Queue(), gui=False) -> None:
+    def __init__(self, functions: type, queue: Queue = None, gui=False, dispatcher: Dispatcher = None,
+                 backend: str = None) -> None:
         super().__init__()
         self.functions = functions
         self.queue = queue
+        self.backend = backend
+        self.dispatcher = dispatcher if dispatcher is not None else PoolDispatcher()
         self.midi_device = None
-        self.first_run = True
 
         if gui:
+            # Only imported when needed, because it takes a while and needs tkinter
+            import PySimpleGUI as sg
+
             # Create list to display:
-            devices = midi.get_devices()
+            devices = midi.get_devices(backend=self.backend)
             device_list = []
             for i, device in enumerate(devices):
                 device_list.append((str(i), device[0].decode() + " " + device[1].decode() + ", " +
@@ -38,7 +42,7 @@ class MidiMacro(Thread):
             window.close()
 
             # Create midi object
-            ids = midi.get_id_pair(int(values['-LIST-'][0][0]))
+            ids = midi.get_id_pair(int(values['-LIST-'][0][0]), self.backend)
             self.midi_in = ids[0]
             self.midi_out = ids[1]
             self.start_midi(ids[0], ids[1])
@@ -46,25 +50,8 @@ class MidiMacro(Thread):
             self.start_midi()
 
     def start_midi(self, input_id: int = None, output_id: int = None, queue: Queue = None):
-        # Initialise and start Midi thread
-        self.midi_device = midi.Midi(input_id, output_id, queue)
-
-        def wait_for_thread():
-            # Wait until it finishes
-            self.midi_device.join()
-            # Restart if needed
-            if self.midi_device.try_to_reconnect:
-                print("\nTrying to reconnect...")
-                ids = self.midi_device.wait_for_reconnect()
-                self.start_midi(ids[0], ids[1], queue)
-
-        if not self.first_run:
-            print("Reconnected\nEnter to exit")
-            self.run()
-        self.first_run = False
-
-        waiter = Thread(target=wait_for_thread)
-        waiter.start()
+        # Initialise and start Midi thread, it reconnects by itself if the device is unplugged
+        self.midi_device = midi.Midi(input_id, output_id, queue, self.dispatcher, self.backend)
 
     def run(self) -> None:
         functions = self.functions
@@ -0,0 +1,119 @@
+import threading
+import time
+
+SEQ_CLIENTS = '/proc/asound/seq/clients'
+# Files that change when ALSA sound cards or sequencer clients (which includes midi devices) come and go
+WATCHED_FILES = ('/proc/asound/cards', SEQ_CLIENTS)
+
+
+def _kernel_clients(content: bytes) -> bytes:
+    """
+    Returns only the client and port lines of the kernel clients (devices) in /proc/asound/seq/clients.
+    The rest changes while devices stay the same: programs add user clients (PortMidi and rtmidi do on every
+    init), and the pool counters and connections change with the midi traffic
+    """
+    lines = []
+    kernel = False
+    for line in content.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith(b'Client '):
+            # Client  20 : "Launchkey MK2 25" [Kernel] (newer kernels add more words after Kernel or User)
+            kernel = b'[Kernel' in line
+            if kernel:
+                lines.append(stripped)
+        elif kernel and stripped.startswith(b'Port '):
+            lines.append(stripped)
+    return b'\n'.join(lines)
+
+
+class DeviceMonitor:
+    """
+    Notices when midi devices are (dis)connected, so that device lists only have to be scanned after a change.
+    Uses udev events if pyudev is installed, and otherwise compares the (small) ALSA files in /proc every
+    INTERVAL seconds. If neither is available, every wait is treated as a possible change.
+    """
+    INTERVAL = 0.5
+
+    def __init__(self) -> None:
+        # Increased on every change, so that every user can keep track of which changes it has seen
+        self.generation = 0
+        self._changed = threading.Condition()
+
+        try:
+            import pyudev
+            thread = threading.Thread(target=self._watch_udev, args=(pyudev, ))
+        except ImportError:
+            thread = threading.Thread(target=self._watch_files) if self._read_files() is not None else None
+
+        # False if changes can not be noticed
+        self.reliable = thread is not None
+        if thread is not None:
+            thread.name = "Midi device monitor"
+            thread.daemon = True
+            thread.start()
+
+    def _notify(self) -> None:
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def _watch_udev(self, pyudev) -> None:
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by('sound')
+        # Blocks until the kernel announces a change
+        for _ in iter(monitor.poll, None):
+            self._notify()
+
+    @staticmethod
+    def _read_files() -> tuple:
+        """ Returns the contents of the watched files, or None if none of them exist """
+        contents = []
+        for path in WATCHED_FILES:
+            try:
+                with open(path, 'rb') as file:
+                    content = file.read()
+                contents.append(_kernel_clients(content) if path == SEQ_CLIENTS else content)
+            except OSError:
+                contents.append(None)
+        if all(content is None for content in contents):
+            return None
+        return tuple(contents)
+
+    def _watch_files(self) -> None:
+        last = self._read_files()
+        while True:
+            time.sleep(self.INTERVAL)
+            contents = self._read_files()
+            if contents != last:
+                last = contents
+                self._notify()
+
+    def changed_since(self, generation: int) -> bool:
+        """ Returns whether something changed after `generation`, always True if the monitor is not reliable """
+        return not self.reliable or self.generation != generation
+
+    def wait(self, generation: int, timeout: float = None) -> int:
+        """
+        Wait until something changes after `generation`, or until the timeout has passed.
+        Returns the generation to pass next time
+        """
+        if not self.reliable:
+            # Nothing can be noticed, so let the caller check again soon
+            time.sleep(self.INTERVAL if timeout is None else min(timeout, self.INTERVAL))
+            return self.generation
+        with self._changed:
+            self._changed.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor() -> DeviceMonitor:
+    """ Returns the device monitor, which is shared by all Midi objects """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = DeviceMonitor()
+        return _monitor
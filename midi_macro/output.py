@@ -0,0 +1,151 @@
+import threading
+from typing import Callable
+
+NOTE_ON = 0x90
+CC = 0xB0
+PITCH_WHEEL = 0xE0
+# PortMidi does not write more than 1024 events at once
+MAX_WRITE = 1024
+
+
+class OutputQueue:
+    """
+    Writes midi output from a separate thread.
+    Everything that is put in the queue while the previous write is busy is written at once in the next one.
+    SysEx messages are written in order with the other messages, using write_sysex(data).
+    """
+
+    def __init__(self, get_output: Callable) -> None:
+        """
+        :param get_output: returns the output to write to, which can change when reconnecting
+        """
+        self._get_output = get_output
+        # [status, data1, data2] messages and SysEx messages (bytes) that still need to be written
+        self._messages = []
+        # Key -> index in _messages, of messages that can be replaced by newer ones
+        self._keys = dict()
+        self._changed = threading.Condition()
+        self._running = True
+        # Amount of messages and write calls
+        self.written = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name="Midi output")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, status: int, data1: int = 0, data2: int = 0, key=None) -> None:
+        """
+        Write a message
+        :param key: if set, a waiting message with the same key is replaced by this one
+        """
+        with self._changed:
+            if key is not None and key in self._keys:
+                self._messages[self._keys[key]] = [status, data1, data2]
+                return
+            if key is not None:
+                self._keys[key] = len(self._messages)
+            self._messages.append([status, data1, data2])
+            self._changed.notify()
+
+    def put_sysex(self, data: bytes) -> None:
+        """ Write a SysEx message, from 0xF0 to 0xF7 """
+        data = bytes(data)
+        if len(data) < 2 or data[0] != 0xF0 or data[-1] != 0xF7:
+            raise ValueError("SysEx messages start with 0xF0 and end with 0xF7")
+        with self._changed:
+            self._messages.append(data)
+            self._changed.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while self._running and not self._messages:
+                    self._changed.wait()
+                if not self._messages:
+                    return
+                messages, self._messages = self._messages, []
+                self._keys.clear()
+
+            # noinspection PyBroadException
+            try:
+                self._write(messages)
+            except Exception:
+                # The device is disconnected, the messages are lost
+                pass
+
+    def _write(self, messages: [list]) -> None:
+        output = self._get_output()
+        start = 0
+        for end in range(len(messages) + 1):
+            if end < len(messages) and messages[end].__class__ is list:
+                continue
+            # Write the short messages before this SysEx message, then the SysEx message
+            for i in range(start, end, MAX_WRITE):
+                output.write([[message, 0] for message in messages[i:min(i + MAX_WRITE, end)]])
+                self.writes += 1
+            if end < len(messages):
+                output.write_sysex(messages[end])
+                self.writes += 1
+            start = end + 1
+        self.written += len(messages)
+
+    def close(self) -> None:
+        """ Write what is waiting, and stop """
+        with self._changed:
+            self._running = False
+            self._changed.notify()
+        self._thread.join()
+
+
+class OutputState:
+    """
+    The state of LEDs and motor faders of a device.
+    Only changes are sent: setting something to the value it already has does not write anything,
+    and if something changes several times before it is written, only the last value is written.
+    """
+
+    def __init__(self, queue: OutputQueue) -> None:
+        self._queue = queue
+        # Key -> last [status, data1, data2] message
+        self._known = dict()
+        self._lock = threading.Lock()
+
+    def _set(self, key: int, status: int, data1: int, data2: int) -> None:
+        message = [status, data1, data2]
+        with self._lock:
+            if self._known.get(key) == message:
+                return
+            self._known[key] = message
+            # While holding the lock, so that the queue gets changes in the same order
+            self._queue.put(status, data1, data2, key)
+
+    def note(self, channel: int, note: int, velocity: int) -> None:
+        """
+        Set the LED of a note (pad or button)
+        :param channel: midi channel (1-16)
+        :param velocity: 0 for off, many devices use the velocity for the colour
+        """
+        status = NOTE_ON | (channel - 1)
+        self._set(status << 8 | note, status, note, velocity)
+
+    def cc(self, channel: int, control: int, value: int) -> None:
+        """ Set a controller, like a motor fader or a LED ring """
+        status = CC | (channel - 1)
+        self._set(status << 8 | control, status, control, value)
+
+    def pitch(self, channel: int, value: int) -> None:
+        """ Set a pitch wheel message (0-16383), which many devices use for motor faders """
+        status = PITCH_WHEEL | (channel - 1)
+        self._set(status << 8, status, value & 0x7F, value >> 7 & 0x7F)
+
+    def resend(self) -> None:
+        """ Send the whole state again, for example when the device was reconnected """
+        with self._lock:
+            known = list(self._known.items())
+        for key, (status, data1, data2) in known:
+            self._queue.put(status, data1, data2, key)
+
+    def forget(self) -> None:
+        """ Forget the state, so that everything is sent again when it is set """
+        with self._lock:
+            self._known.clear()
@@ -0,0 +1,189 @@
+"""
+Running handlers in worker processes, so that CPU heavy functions do not hold the GIL of the midi input,
+and functions that hang or crash do not take the program down with them.
+
+Every worker thread of the dispatcher owns one process, and sends it one call at a time over a pipe.
+Functions are pickled and sent to a process once, after that a call is 4 bytes: the number of the function
+and the two values.
+"""
+import multiprocessing
+import pickle
+import signal
+import struct
+import threading
+import time
+import traceback
+from typing import Callable
+
+from midi_macro.dispatcher import Backpressure, PoolDispatcher
+from midi_macro.stats import Stats
+from midi_macro.transforms import Transformed
+
+# Function number, value1, value2
+_CALL = struct.Struct('<HBB')
+_OK = b'\x00'
+_FAILED = b'\x01'
+
+
+def _worker_main(connection) -> None:
+    """ Runs in the worker process """
+    # Ctrl+C is handled by the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    functions = dict()
+    while True:
+        try:
+            data = connection.recv_bytes()
+        except (EOFError, OSError):
+            return
+        if len(data) == _CALL.size:
+            number, value1, value2 = _CALL.unpack(data)
+            function, args = functions[number], (value1, value2)
+        else:
+            number, function, args = pickle.loads(data)
+            if function is not None:
+                functions[number] = function
+            else:
+                function = functions[number]
+            if args is None:
+                # Only registering the function
+                continue
+        # noinspection PyBroadException
+        try:
+            function(args)
+            connection.send_bytes(_OK)
+        except Exception:
+            traceback.print_exc()
+            connection.send_bytes(_FAILED)
+
+
+class Worker:
+    """ A worker process, restarted when it crashes or takes too long """
+
+    def __init__(self, context) -> None:
+        self._context = context
+        self.process = None
+        self._connection = None
+        # Numbers of the functions that this process has
+        self._functions = set()
+        self.start()
+
+    def start(self) -> None:
+        self._connection, child = self._context.Pipe()
+        self.process = self._context.Process(target=_worker_main, args=(child, ), name="Midi worker", daemon=True)
+        self.process.start()
+        child.close()
+        self._functions = set()
+
+    def call(self, number: int, function: Callable[[tuple], None], args: tuple, timeout: float) -> bytes:
+        """
+        Run a function in the process, returns _OK or _FAILED
+        :raises TimeoutError: if it did not finish within the timeout
+        :raises EOFError: if the process died
+        """
+        if number not in self._functions:
+            self._connection.send_bytes(pickle.dumps((number, function, None)))
+            self._functions.add(number)
+        if (len(args) == 2 and type(args[0]) is int and type(args[1]) is int and
+                0 <= args[0] < 256 and 0 <= args[1] < 256):
+            self._connection.send_bytes(_CALL.pack(number, *args))
+        else:
+            self._connection.send_bytes(pickle.dumps((number, None, args)))
+        if not self._connection.poll(timeout):
+            raise TimeoutError
+        return self._connection.recv_bytes()
+
+    def restart(self) -> None:
+        self.stop()
+        self.start()
+
+    def stop(self) -> None:
+        self._connection.close()
+        self.process.join(0.5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class ProcessDispatcher(PoolDispatcher):
+    """
+    Runs handlers in worker processes. Like PoolDispatcher, calls to the same handler run one at a time and in order.
+    Handlers must be picklable, e.g. functions defined at the top level of a module, and they get their own copy
+    of everything, so they can not change objects of the main process.
+    A worker is restarted when it crashes (counted in `crashed`), or when a call takes longer than `timeout`
+    (counted in `timed_out`).
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 64,
+                 backpressure: Backpressure = Backpressure.DROP_OLDEST, timeout: float = 10.0,
+                 start_method: str = 'spawn') -> None:
+        """
+        :param workers: amount of worker processes, they are started when they are first needed
+        :param max_pending: maximum amount of waiting calls per handler
+        :param backpressure: what to do with new calls when a handler has `max_pending` calls waiting
+        :param timeout: seconds after which a call is stopped by restarting its worker, None to wait forever
+        :param start_method: how to start the processes, see multiprocessing.get_context. The default does not
+            copy the threads and locks of this process, so it is safe but starting a worker takes a while
+        """
+        self.timeout = timeout
+        self.crashed = 0
+        self.timed_out = 0
+        # Calls that raised an exception, the traceback is printed by the worker
+        self.failed = 0
+        self._context = multiprocessing.get_context(start_method)
+        # Function -> number, so that calls only have to send a number
+        self._numbers = dict()
+        self._local = threading.local()
+        self._processes = []
+        self._processes_lock = threading.Lock()
+        super().__init__(workers, max_pending, backpressure)
+
+    def _number(self, function: Callable[[tuple], None]) -> int:
+        with self._processes_lock:
+            number = self._numbers.get(function)
+            if number is None:
+                number = self._numbers[function] = len(self._numbers)
+            return number
+
+    def _worker(self) -> Worker:
+        """ Returns the process of the current worker thread """
+        worker = getattr(self._local, 'worker', None)
+        if worker is None:
+            worker = self._local.worker = Worker(self._context)
+            with self._processes_lock:
+                self._processes.append(worker)
+        return worker
+
+    def _call(self, function: Callable[[tuple], None], args: tuple, received: float, submitted: float,
+              stats: Stats) -> None:
+        started = time.perf_counter()
+        if isinstance(function, Transformed):
+            # Hysteresis and smoothing keep state, which has to stay in this process: the calls of a function
+            # can go to different workers
+            args = function.apply(args)
+            if args is None:
+                return
+            function = function.function
+        worker = self._worker()
+        try:
+            if worker.call(self._number(function), function, args, self.timeout) == _FAILED:
+                self.failed += 1
+        except TimeoutError:
+            print("Midi worker: " + str(function) + " took longer than " + str(self.timeout) + "s, restarting")
+            self.timed_out += 1
+            worker.restart()
+        except (EOFError, OSError):
+            if not self._running:
+                # Stopped by close()
+                return
+            print("Midi worker: process stopped while running " + str(function) + ", restarting")
+            self.crashed += 1
+            worker.restart()
+        if stats is not None:
+            stats.add_call(function, received, submitted, started, time.perf_counter())
+
+    def close(self) -> None:
+        super().close()
+        with self._processes_lock:
+            processes, self._processes = self._processes, []
+        for worker in processes:
+            worker.stop()
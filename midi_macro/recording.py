@@ -0,0 +1,208 @@
+"""
+Recording midi input to a file, and replaying it without a midi device.
+
+A recording starts with MAGIC, followed by (timestamp, message) pairs of little-endian 32 bit numbers:
+the timestamp in ms as given by the backend, and the message packed like backends.pack().
+"""
+import sys
+import threading
+import time
+from array import array
+
+from midi_macro.backends import Backend
+
+MAGIC = b'MIDIREC1'
+
+
+def _to_file(data: array, file) -> None:
+    if sys.byteorder == 'big':
+        data = array('I', data)
+        data.byteswap()
+    data.tofile(file)
+
+
+def write_recording(path: str, messages: array, timestamps: array) -> None:
+    """ Write messages and their timestamps (in ms) to a recording file """
+    data = array('I', [0]) * (2 * len(messages))
+    data[0::2] = array('I', timestamps)
+    data[1::2] = array('I', messages)
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        _to_file(data, file)
+
+
+def read_recording(path: str) -> (array, array):
+    """ Returns the (messages, timestamps) of a recording file """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a midi recording")
+        data = array('I')
+        data.frombytes(file.read())
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data[1::2], data[0::2]
+
+
+class Recorder:
+    """ Writes everything a Midi object receives to a recording file, see Midi.record """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, messages: array, timestamps: array) -> None:
+        """ Called by the input loop with every batch of messages """
+        data = array('I', [0]) * (2 * len(messages))
+        data[0::2] = timestamps
+        data[1::2] = messages
+        with self._lock:
+            if self._file is not None:
+                _to_file(data, self._file)
+                self.count += len(messages)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ReplayInput:
+    """ Gives the messages of a recording at the times they were recorded, or as fast as possible """
+    # Most messages to give at once when replaying as fast as possible
+    BATCH = 1024
+
+    def __init__(self, messages: array, timestamps: array, speed: float = 1.0, device_id: int = 0,
+                 autoplay: bool = True) -> None:
+        """
+        :param speed: 1.0 for real time, 2.0 for twice as fast, etc. None to give everything as fast as possible
+        :param autoplay: start right away, otherwise nothing is given until play() is called
+        """
+        self.device_id = device_id
+        self.wakeup = None
+        self._messages = messages
+        self._timestamps = timestamps
+        self._speed = speed
+        self._position = 0
+        self._start = None
+        self._playing = threading.Event()
+        self._first = timestamps[0] if len(timestamps) else 0
+        # Set when everything has been read
+        self.finished = threading.Event()
+        if not len(messages):
+            self.finished.set()
+        if autoplay:
+            self.play()
+
+    def play(self) -> None:
+        self._start = time.perf_counter()
+        self._playing.set()
+
+    def _due(self, position: int) -> float:
+        """ Returns the perf_counter() time at which a message should be given """
+        return self._start + (self._timestamps[position] - self._first) / 1000 / self._speed
+
+    def poll(self) -> bool:
+        if not self._playing.is_set() or self._position >= len(self._messages):
+            return False
+        return self._speed is None or self._due(self._position) <= time.perf_counter()
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Wait until there is data to read, returns False if the timeout has passed """
+        if not self._playing.wait(timeout):
+            return False
+        if self._position >= len(self._messages):
+            time.sleep(timeout if timeout is not None else 1)
+            return False
+        if self._speed is None:
+            return True
+        delay = self._due(self._position) - time.perf_counter()
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def read(self) -> (array, array):
+        """ Returns the (messages, timestamps) that are due, see backends.pack() """
+        start = self._position
+        end = min(start + self.BATCH, len(self._messages))
+        if self._speed is not None:
+            now = time.perf_counter()
+            while end > start and self._due(end - 1) > now:
+                end -= 1
+        self._position = end
+        if end >= len(self._messages):
+            self.finished.set()
+        return self._messages[start:end], self._timestamps[start:end]
+
+    def close(self) -> None:
+        self._position = len(self._messages)
+
+
+class NullOutput:
+    """ Output that counts and discards messages """
+
+    def __init__(self, device_id: int = 1) -> None:
+        self.device_id = device_id
+        self.written = 0
+
+    def write_short(self, status: int, data1: int = 0, data2: int = 0) -> None:
+        self.written += 1
+
+    def write(self, events: [list]) -> None:
+        self.written += len(events)
+
+    def write_sysex(self, data: bytes) -> None:
+        self.written += 1
+
+    def note_on(self, note: int, velocity: int, channel: int = 0) -> None:
+        self.written += 1
+
+    def note_off(self, note: int, velocity: int = 0, channel: int = 0) -> None:
+        self.written += 1
+
+    def is_connected(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayBackend(Backend):
+    """
+    Replays a recording as device 0, with an output that discards everything as device 1:
+        register_backend('replay', ReplayBackend('session.midirec'))
+        midi = Midi(0, 1, backend='replay')
+    """
+
+    def __init__(self, path: str = None, speed: float = 1.0, messages: array = None,
+                 timestamps: array = None, autoplay: bool = True) -> None:
+        """
+        :param path: recording file, or pass messages and timestamps instead
+        :param speed: 1.0 for real time, 2.0 for twice as fast, etc. None to replay as fast as possible
+        :param autoplay: start replaying when the input is opened, otherwise call input.play()
+        """
+        if path is not None:
+            messages, timestamps = read_recording(path)
+        self.messages = messages
+        self.timestamps = timestamps
+        self.speed = speed
+        self.autoplay = autoplay
+        # The last opened input and output
+        self.input = None
+        self.output = None
+
+    def get_devices(self) -> [tuple]:
+        return [(b'replay', b'Replay', 1, 0, 0), (b'replay', b'Replay', 0, 1, 0)]
+
+    def open_input(self, device_id: int) -> ReplayInput:
+        self.input = ReplayInput(self.messages, self.timestamps, self.speed, device_id, self.autoplay)
+        return self.input
+
+    def open_output(self, device_id: int) -> NullOutput:
+        self.output = NullOutput(device_id)
+        return self.output
@@ -0,0 +1,155 @@
+import itertools
+from typing import Callable, Iterable, Union
+
+# Bit mask of all 128 values
+ALL = (1 << 128) - 1
+# Gives rules the order in which they were created
+_order = itertools.count()
+
+Values = Union[int, Iterable[int], Callable[[int], bool]]
+
+
+def values_mask(values: Values) -> int:
+    """
+    Returns a bit mask of the values that match
+    :param values: a value (0-127), -1 for any value, an iterable of values (like a range or a set),
+        or a function that returns whether a value matches
+    """
+    if isinstance(values, int):
+        return ALL if values == -1 else 1 << values
+    if callable(values):
+        values = [value for value in range(128) if values(value)]
+    mask = 0
+    for value in values:
+        if not 0 <= value <= 127:
+            raise ValueError("Midi values are between 0 and 127, not " + str(value))
+        mask |= 1 << value
+    return mask
+
+
+class Rule:
+    """ A handler with the values it matches """
+    __slots__ = ('handler', 'values1', 'values2', 'priority', 'order', '_key')
+
+    def __init__(self, handler, value1: Values = -1, value2: Values = -1, priority: int = 0) -> None:
+        """
+        :param handler: anything, it is returned by RoutingTable.get()
+        :param value1: first values, see values_mask
+        :param value2: second values, see values_mask
+        :param priority: rules with a higher priority win over other rules that match the same message
+        """
+        self.handler = handler
+        self.values1 = values_mask(value1)
+        self.values2 = values_mask(value2)
+        self.priority = priority
+        self.order = next(_order)
+        # Rules that sort first win: higher priority, then fewer values1, then fewer values2, then added later
+        self._key = (-priority, bin(self.values1).count('1'), bin(self.values2).count('1'), -self.order)
+
+
+class RoutingTable:
+    """
+    Maps midi messages to handlers.
+    Rules are stored per (channel, type), and match a set of value1s and a set of value2s.
+    Every time they change, the result for each (status byte, value1) pair is resolved into a flat list,
+    so finding the handler for a message costs a single index, whether there is a handler or not,
+    and no matter how many rules overlap.
+    If several rules match a message, the one with the highest priority wins. With equal priorities the rule
+    that matches the fewest value1s wins, then the one that matches the fewest value2s, then the newest one.
+    """
+
+    def __init__(self) -> None:
+        # (channel, type) -> [Rule]
+        self._rules = dict()
+        # Indexed by (status - 128) * 128 + value1. An entry is None, a handler,
+        # or a list of 128 handlers (one per value2) if the handler depends on value2
+        self._table = [None] * (128 * 128)
+
+    @staticmethod
+    def _status(channel: int, m_type: int) -> int:
+        return 0x80 | m_type << 4 | (channel - 1)
+
+    def add(self, handler, channel: int, m_type: int, value1: Values = -1, value2: Values = -1,
+            priority: int = 0) -> Rule:
+        """
+        Add a handler
+        :param handler: anything, it is returned by get()
+        :param channel: midi channel (1-16)
+        :param m_type: message type (see Midi.Type)
+        :param value1: first values, see values_mask
+        :param value2: second values, see values_mask
+        :param priority: see Rule
+        :return: the rule
+        """
+        rule = Rule(handler, value1, value2, priority)
+        self.add_rule(rule, channel, m_type)
+        return rule
+
+    def add_rule(self, rule: Rule, channel: int, m_type: int, resolve: bool = True) -> None:
+        """
+        Add a rule, replacing a rule that matches exactly the same values with the same priority
+        :param resolve: update the table, set to False when adding many rules and call resolve() afterwards
+        """
+        rules = self._rules.setdefault((channel, m_type), [])
+        for i, old in enumerate(rules):
+            if (old.values1, old.values2, old.priority) == (rule.values1, rule.values2, rule.priority):
+                rules.pop(i)
+                break
+        rules.append(rule)
+        if resolve:
+            self._resolve(channel, m_type, rule.values1)
+
+    def remove(self, channel: int, m_type: int, value1: Values = -1, value2: Values = -1) -> Rule:
+        """
+        Remove the most specific rule that matches: the one with exactly these values,
+        otherwise the one with these value1s for any value2, otherwise the one for any value.
+        Returns the removed rule, or None if nothing matched
+        """
+        rules = self._rules.get((channel, m_type), [])
+        values1 = values_mask(value1)
+        for values in ((values1, values_mask(value2)), (values1, ALL), (ALL, ALL)):
+            # Newest first
+            for rule in reversed(rules):
+                if (rule.values1, rule.values2) == values:
+                    rules.remove(rule)
+                    self._resolve(channel, m_type, rule.values1)
+                    return rule
+
+    def rules(self) -> [(int, int, Rule)]:
+        """ Returns (channel, type, rule) for every rule """
+        return [(channel, m_type, rule) for (channel, m_type), rules in self._rules.items() for rule in rules]
+
+    def resolve(self) -> None:
+        """ Update the whole table """
+        for channel, m_type in self._rules:
+            self._resolve(channel, m_type, ALL)
+
+    def _resolve(self, channel: int, m_type: int, values1: int) -> None:
+        """ Update the table entries of the value1s in a mask """
+        rules = sorted(self._rules.get((channel, m_type), []), key=lambda r: r._key)
+        offset = (self._status(channel, m_type) - 128) * 128
+
+        for v1 in range(128):
+            if not values1 >> v1 & 1:
+                continue
+            matching = [rule for rule in rules if rule.values1 >> v1 & 1]
+            if not matching:
+                self._table[offset + v1] = None
+            elif matching[0].values2 == ALL:
+                self._table[offset + v1] = matching[0].handler
+            else:
+                # Let the rules that win overwrite the others
+                row = [None] * 128
+                for rule in reversed(matching):
+                    handler = rule.handler
+                    for v2 in range(128):
+                        if rule.values2 >> v2 & 1:
+                            row[v2] = handler
+                self._table[offset + v1] = row
+
+    def get(self, status: int, value1: int, value2: int):
+        """ Returns the handler for a message, or None """
+        entry = self._table[(status - 128) << 7 | value1]
+        if entry.__class__ is list:
+            return entry[value2]
+        return entry
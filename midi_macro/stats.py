@@ -0,0 +1,113 @@
+import math
+import threading
+from typing import Callable
+
+
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets from 1 µs to about 100 s.
+    Percentiles are accurate to within one bucket (about 19%).
+    """
+    # Each bucket is this much larger than the previous one
+    FACTOR = 2 ** 0.25
+    BUCKETS = 108
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        if seconds <= 1e-6:
+            bucket = 0
+        else:
+            bucket = min(math.ceil(math.log(seconds / 1e-6, self.FACTOR)), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """ Returns the upper bound of the bucket that contains the p-th percentile, in seconds """
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(1e-6 * self.FACTOR ** bucket, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+def _name(function: Callable) -> str:
+    return getattr(function, '__qualname__', repr(function))
+
+
+class Stats:
+    """
+    Latency and throughput statistics of a Midi object. All times are in seconds.
+    - dispatch: from reading a message to handing it to the dispatcher
+    - wait (per handler): from being handed to the dispatcher to the handler starting
+    - run (per handler): how long the handler ran
+    - latency (per handler): from reading the message to the handler finishing
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.received = 0
+        self.unmatched = 0
+        self.ignored = 0
+        self.dispatch = Histogram()
+        self.handlers = dict()
+
+    def add_dispatch(self, received: float, submitted: float) -> None:
+        with self._lock:
+            self.dispatch.add(submitted - received)
+
+    def add_call(self, function: Callable, received: float, submitted: float, started: float,
+                 finished: float) -> None:
+        name = _name(function)
+        with self._lock:
+            histograms = self.handlers.get(name)
+            if histograms is None:
+                histograms = self.handlers[name] = {'wait': Histogram(), 'run': Histogram(), 'latency': Histogram()}
+            histograms['wait'].add(started - submitted)
+            histograms['run'].add(finished - started)
+            histograms['latency'].add(finished - received)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'received': self.received,
+                    'unmatched': self.unmatched,
+                    'ignored': self.ignored,
+                    'dispatch': self.dispatch.summary(),
+                    'handlers': {name: {kind: histogram.summary() for kind, histogram in histograms.items()}
+                                 for name, histograms in self.handlers.items()}}
+
+
+def format_stats(stats: dict) -> str:
+    """ Returns a Midi.stats() dict as readable text """
+    def ms(seconds: float) -> str:
+        return "{:.2f}ms".format(seconds * 1000)
+
+    def line(name: str, summary: dict) -> str:
+        return "  {:<30} n={:<8} p50={:<9} p99={:<9} max={}".format(
+            name, summary['count'], ms(summary['p50']), ms(summary['p99']), ms(summary['max']))
+
+    lines = ["received={received} unmatched={unmatched} ignored={ignored} dropped={dropped} "
+             "coalesced={coalesced} queue_depth={queue_depth}".format(**stats),
+             line('dispatch', stats['dispatch'])]
+    for name, histograms in stats['handlers'].items():
+        for kind, summary in histograms.items():
+            lines.append(line(name + ' ' + kind, summary))
+    return "\n".join(lines)
@@ -0,0 +1,116 @@
+"""
+Receiving system exclusive (SysEx) messages.
+
+Backends give SysEx messages like PortMidi does: as a series of packed messages (see backends.pack) that each hold
+4 bytes of the message, the first one starting with 0xF0 and the last one containing 0xF7.
+These are written straight into a buffer that grows by doubling, so large dumps are put together in linear time,
+and the function gets a memoryview of the buffer instead of a copy.
+"""
+import struct
+import threading
+
+START = 0xF0
+END = 0xF7
+_CHUNK = struct.Struct('<I')
+
+
+class SysexAssembler:
+    """ Puts SysEx messages together, and gives them to the function that is registered for their first bytes """
+    # Starting size of the buffer
+    SIZE = 256
+    # Messages that get longer than this are dropped
+    MAX_SIZE = 1 << 24
+
+    def __init__(self) -> None:
+        # Prefix (the bytes after 0xF0, e.g. the manufacturer id) -> handler
+        self._routes = dict()
+        # Lengths of the prefixes, longest first
+        self._lengths = []
+        self._lock = threading.Lock()
+        self._buffer = bytearray(self.SIZE)
+        self._length = 0
+        # Whether a message is being received
+        self.active = False
+        # Complete messages, and messages that were dropped because they were too long or broken off
+        self.messages = 0
+        self.dropped = 0
+
+    def add(self, handler, prefix: bytes = b'') -> None:
+        with self._lock:
+            routes = dict(self._routes)
+            routes[bytes(prefix)] = handler
+            self._set_routes(routes)
+
+    def remove(self, prefix: bytes = b'') -> None:
+        with self._lock:
+            routes = dict(self._routes)
+            routes.pop(bytes(prefix), None)
+            self._set_routes(routes)
+
+    def _set_routes(self, routes: dict) -> None:
+        # Replaced instead of changed, so that the input loop can use them without locking
+        self._lengths = sorted(set(len(prefix) for prefix in routes), reverse=True)
+        self._routes = routes
+
+    def feed(self, message: int, received: float) -> bool:
+        """ Handle a packed message, returns whether it was part of a SysEx message. Called by the input loop """
+        status = message & 0xFF
+        if status == START:
+            if self.active:
+                self.dropped += 1
+            self.active = True
+            self._length = 0
+        elif not self.active:
+            return False
+        elif status >= 0x80 and status != END:
+            # Not SysEx. Real-time messages can come in between, other messages end it
+            if status < 0xF8:
+                self.abort()
+            return False
+
+        length = self._length
+        if length + 4 > len(self._buffer):
+            if length + 4 > self.MAX_SIZE:
+                self.abort()
+                self._buffer = bytearray(self.SIZE)
+                return True
+            self._buffer.extend(bytes(len(self._buffer)))
+        _CHUNK.pack_into(self._buffer, length, message)
+        self._length = length + 4
+
+        # Data bytes are below 0x80, so only look at the bytes if one of them is not
+        if message & (0x80808000 if status == START else 0x80808080):
+            for i in range(1 if status == START else 0, 4):
+                byte = message >> (8 * i) & 0xFF
+                if byte == END:
+                    self._complete(length + i + 1, received)
+                    break
+                if byte >= 0x80:
+                    # Another status byte, the message was broken off
+                    self.abort()
+                    break
+        return True
+
+    def abort(self) -> None:
+        """ Drop the message that is being received, for example because another message started """
+        if self.active:
+            self.active = False
+            self.dropped += 1
+
+    def _complete(self, length: int, received: float) -> None:
+        self.active = False
+        self.messages += 1
+        buffer = self._buffer
+        routes = self._routes
+        handler = None
+        for prefix_length in self._lengths:
+            if prefix_length <= length - 2:
+                handler = routes.get(bytes(buffer[1:1 + prefix_length]))
+                if handler is not None:
+                    break
+        if handler is None:
+            # Nobody has the buffer, so it can be used for the next message
+            return
+        # The function gets this buffer, the next message gets a new one of about the same size
+        self._buffer = bytearray(max(self.SIZE, (length + 3) & ~3))
+        handler.dispatcher.submit(handler.function, memoryview(buffer)[:length], None, received, handler.stats)
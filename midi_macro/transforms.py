@@ -0,0 +1,170 @@
+"""
+Response curves, scaling and smoothing of the values that functions get.
+
+The curve, dead zone, inversion and scaling of a Transform are worked out once for every possible value,
+into a lookup table of 128 values (16384 for pitch wheel and the 14 bit types of highres), so applying them
+costs one index per event.
+Hysteresis and smoothing depend on earlier values, so they are applied after the lookup.
+"""
+import math
+from typing import Callable, Union
+
+from midi_macro.dispatcher import iscoroutinefunction
+
+CURVES = ('linear', 'log', 'exp')
+# Names of the Midi.Types with 14 bit values, see highres
+HIGH_RESOLUTION = ('CC_14', 'NRPN', 'RPN', 'PITCH_WHEEL_14')
+
+
+class Transform:
+    """
+    Changes value2 before it is given to a function, see Midi.add_event:
+        midi.add_event(set_volume, 1, Midi.Type.CC, 7, transform=Transform(curve='log', scale=(0.0, 1.0)))
+    The steps are applied in this order: dead zone, invert, curve, scale, hysteresis, smoothing.
+    """
+
+    def __init__(self, curve: str = 'linear', scale: (float, float) = None, invert: bool = False,
+                 dead_zone: int = 0, hysteresis: int = 0, smoothing: float = None, steepness: float = 4.0) -> None:
+        """
+        :param curve: 'linear', 'log' (changes fast at the start, like a volume knob) or 'exp' (slow at the start)
+        :param scale: (minimum, maximum) to scale the value to, otherwise the value stays in the range of the
+            midi value (0-127, or 0-16383 for pitch wheel and 14 bit values)
+        :param invert: reverse the value
+        :param dead_zone: values up to this are treated as 0. For pitch wheels it is the distance around the
+            centre that is treated as the centre
+        :param hysteresis: ignore changes smaller than this (in midi values), for knobs that jitter between
+            two values. The lowest and highest value always get through
+        :param smoothing: if set, give an exponential moving average instead of the value itself,
+            from 0 (never changes) to 1 (no smoothing)
+        :param steepness: how strongly the log and exp curves bend
+        """
+        if curve not in CURVES:
+            raise ValueError("curve should be one of " + ", ".join(CURVES) + ", not " + repr(curve))
+        if smoothing is not None and not 0 < smoothing <= 1:
+            raise ValueError("smoothing should be more than 0 and at most 1, not " + repr(smoothing))
+        if scale is not None and len(scale) != 2:
+            raise ValueError("scale should be a (minimum, maximum) pair, not " + repr(scale))
+        self.curve = curve
+        self.scale = scale
+        self.invert = invert
+        self.dead_zone = dead_zone
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.steepness = steepness
+        # Size -> lookup table
+        self._tables = dict()
+
+    def _curve(self, x: float) -> float:
+        """ Applies the curve to a value from 0 to 1 """
+        if self.curve == 'linear':
+            return x
+        k = self.steepness
+        if self.curve == 'log':
+            return math.log2(1 + x * (2 ** k - 1)) / k
+        return (2 ** (k * x) - 1) / (2 ** k - 1)
+
+    def table(self, size: int = 128, centred: bool = False) -> list:
+        """
+        Returns the lookup table of the stateless steps
+        :param size: 128, or 16384 for 14 bit values
+        :param centred: whether the centre is the resting position, like for pitch wheels
+        """
+        table = self._tables.get((size, centred))
+        if table is not None:
+            return table
+        top = size - 1
+        table = []
+        for value in range(size):
+            if centred:
+                # Pitch wheel: the dead zone and the curve are around the centre, in both directions
+                offset = value - size // 2
+                span = size // 2 - (1 if offset > 0 else 0)
+                x = max(abs(offset) - self.dead_zone, 0) / max(span - self.dead_zone, 1)
+                x = 0.5 + math.copysign(self._curve(min(x, 1.0)), offset) / 2
+            else:
+                x = max(value - self.dead_zone, 0) / max(top - self.dead_zone, 1)
+            if self.invert:
+                x = 1 - x
+            if not centred:
+                x = self._curve(x)
+            if self.scale is not None:
+                low, high = self.scale
+                table.append(low + (high - low) * x)
+            else:
+                table.append(round(x * top))
+        self._tables[(size, centred)] = table
+        return table
+
+    def wrap(self, function: Callable[[tuple], None], m_type: str = 'CC') -> Callable[[tuple], None]:
+        """
+        Returns a function that calls `function` with the transformed value2.
+        For PITCH_WHEEL the 14 bit value (value2 << 7 | value1) is transformed, and given as value2.
+        :param m_type: name of the Midi.Type of the events
+        """
+        pitch_wheel = m_type == 'PITCH_WHEEL'
+        if pitch_wheel or m_type in HIGH_RESOLUTION:
+            table = self.table(16384, pitch_wheel or m_type == 'PITCH_WHEEL_14')
+        else:
+            table = self.table()
+        if iscoroutinefunction(function):
+            transformed = Transformed(None, self, table, pitch_wheel)
+
+            async def call(values: tuple) -> None:
+                values = transformed.apply(values)
+                if values is not None:
+                    await function(values)
+            call.__qualname__ = getattr(function, '__qualname__', repr(function))
+            return call
+        return Transformed(function, self, table, pitch_wheel)
+
+
+class Transformed:
+    """
+    A function with a Transform, made by Transform.wrap.
+    It is a class instead of a closure, so that it can be pickled to run in a worker process.
+    """
+
+    def __init__(self, function: Union[Callable[[tuple], None], None], transform: Transform, table: list,
+                 pitch_wheel: bool) -> None:
+        self.function = function
+        self.__qualname__ = getattr(function, '__qualname__', repr(function))
+        self.table = table
+        self.pitch_wheel = pitch_wheel
+        self.hysteresis = transform.hysteresis
+        self.smoothing = transform.smoothing
+        self.rounded = transform.scale is None
+        # Control -> last midi value that got through, for hysteresis
+        self._last = dict()
+        # Control -> smoothed value
+        self._average = dict()
+
+    def apply(self, values: tuple) -> Union[tuple, None]:
+        """ Returns the values to give to the function, or None if the change should be ignored """
+        value1, value = values
+        # Every control (e.g. CC number) has its own state, a pitch wheel has only one
+        key = value1
+        if self.pitch_wheel:
+            value = value << 7 | value1
+            key = None
+        if self.hysteresis:
+            last = self._last.get(key)
+            if last is not None and abs(value - last) < self.hysteresis and 0 < value < len(self.table) - 1:
+                return None
+            self._last[key] = value
+        value = self.table[value]
+        if self.smoothing is not None:
+            average = self._average.get(key)
+            if average is not None:
+                value = average + self.smoothing * (value - average)
+            self._average[key] = value
+            if self.rounded:
+                value = round(value)
+        return value1, value
+
+    def __call__(self, values: tuple) -> None:
+        if self.hysteresis or self.smoothing is not None or self.pitch_wheel:
+            values = self.apply(values)
+            if values is not None:
+                self.function(values)
+        else:
+            self.function((values[0], self.table[values[1]]))